@@ -0,0 +1,87 @@
+'''
+Bytes on the wire and client CPU cost with and without permessage-deflate
+
+Runs the client against benchmarks/local_server.py, so no network is needed.
+Run from the repo root:
+
+    python -m benchmarks.compression_benchmark --requests 200 --limit 400
+'''
+import time
+import logging
+import argparse
+from threading import Semaphore
+
+from logger import logger
+from socket_clients.xrpl_socket import XRPLWebsocketClient
+from benchmarks.local_server import LocalXRPLServer, ISSUER
+
+
+class _CountingClient(XRPLWebsocketClient):
+    def __init__(self, *args, **kwargs):
+        self.received = Semaphore(0)
+        super().__init__(*args, **kwargs)
+
+    def _on_message(self, ws, raw_message):
+        super()._on_message(ws, raw_message)
+        self.received.release()
+
+
+def _book(i, limit):
+    return {
+        "id": f'bench-{i}',
+        "taker_gets": {"currency": "XRP"},
+        "taker_pays": {"currency": "USD", "issuer": ISSUER},
+        "limit": limit,
+    }
+
+
+def run(compression, requests, limit):
+    server = LocalXRPLServer(compression=compression).start()
+    try:
+        xrpl = _CountingClient(stream_url=server.url, compression=compression)
+        xrpl.connect()
+
+        # warm up the connection and the compression context
+        xrpl.book_offers(_book(-1, limit))
+        xrpl.received.acquire()
+
+        bytes_before = server.bytes_sent
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        for i in range(requests):
+            xrpl.book_offers(_book(i, limit))
+        for _ in range(requests):
+            xrpl.received.acquire()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+
+        xrpl.close()
+        return dict(
+            compression=compression,
+            wire_bytes=server.bytes_sent - bytes_before,
+            cpu_ms=cpu * 1000,
+            wall_ms=wall * 1000,
+        )
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='book_offers requests per run')
+    parser.add_argument('--limit', type=int, default=400, help='offers per book_offers response')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.ERROR)
+    print(f'{args.requests} x book_offers(limit={args.limit})')
+    print(f'{"compression":<12} {"wire bytes":>14} {"bytes/msg":>10} {"cpu ms":>10} {"wall ms":>10}')
+    for compression in (False, True):
+        r = run(compression, args.requests, args.limit)
+        print(
+            f'{str(r["compression"]):<12} {r["wire_bytes"]:>14,} {r["wire_bytes"] // args.requests:>10,}'
+            f' {r["cpu_ms"]:>10.1f} {r["wall_ms"]:>10.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+'''
+Minimal local XRPL-ish websocket server for benchmarks
+
+Standard library only. It speaks just enough RFC 6455 (and RFC 7692
+permessage-deflate) to answer the commands the client sends with
+realistic looking payloads, so benchmarks never touch a public node.
+
+    >>> server = LocalXRPLServer(compression=True)
+    >>> server.start()
+    >>> XRPLWebsocketClient(stream_url=server.url, compression=True)
+    >>> server.bytes_sent
+    >>> server.stop()
+
+The server runs in its own process so its CPU time is not charged to the client.
+'''
+import json
+import zlib
+import base64
+import socket
+import struct
+import hashlib
+import multiprocessing
+import socketserver
+
+
+_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_OPCODE_TEXT = 0x1
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+_OPCODE_PONG = 0xA
+
+COMMANDS = (
+    'ping', 'random', 'server_info', 'fee', 'account_info', 'account_lines', 'book_offers',
+    'path_find', 'ripple_path_find', 'submit', 'subscribe', 'unsubscribe',
+)
+ACCOUNT = 'rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3'
+ISSUER = 'rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B'
+
+
+def _offer(i):
+    return {
+        "Account": ACCOUNT,
+        "BookDirectory": f"DFA3B6DDAB58C7E8E5D944E736DA4B7046C30E4F460FD9DE4E208EF9{i:08X}",
+        "BookNode": "0",
+        "Flags": 0,
+        "LedgerEntryType": "Offer",
+        "OwnerNode": "0",
+        "PreviousTxnID": hashlib.sha256(str(i).encode()).hexdigest().upper(),
+        "PreviousTxnLgrSeq": 62744195,
+        "Sequence": 1856443 + i,
+        "TakerGets": str(2000000000 + i * 1000),
+        "TakerPays": {"currency": "USD", "issuer": ISSUER, "value": f"{1832.88 + i / 100:.2f}"},
+        "index": hashlib.sha256(f'offer{i}'.encode()).hexdigest().upper(),
+        "owner_funds": "4051335976",
+        "quality": f"0.000000916{i:05d}",
+    }
+
+
+def _alternative(i):
+    return {
+        "paths_computed": [[{"currency": "USD", "issuer": ISSUER, "type": 48}]],
+        "source_amount": str(1000245 + i),
+    }
+
+
+def _line(i):
+    return {
+        "account": ISSUER,
+        "balance": str(i),
+        "currency": f"{i:03d}"[-3:],
+        "limit": "1000000000",
+        "limit_peer": "0",
+        "no_ripple": True,
+        "no_ripple_peer": False,
+        "quality_in": 0,
+        "quality_out": 0,
+    }
+
+
+def submitted_hash(blob):
+    return hashlib.sha512(b'TXN\x00' + blob).digest()[:32].hex().upper()
+
+
+def result_for(request):
+    '''
+    Canned `result` body for a request, sized by the request's `limit`
+    '''
+    command = request.get('command')
+    limit = int(request.get('limit', 10))
+    if command == 'random':
+        return {"random": hashlib.sha256(b'random').hexdigest().upper()}
+    if command == 'account_info':
+        return {
+            "account_data": {"Account": request.get('account'), "Balance": "424021949", "Sequence": 385},
+            "ledger_current_index": 62743963,
+            "validated": False,
+        }
+    if command == 'account_lines':
+        return {"account": request.get('account'), "ledger_index": 62743973,
+                "lines": [_line(i) for i in range(limit)], "validated": True}
+    if command in ('path_find', 'ripple_path_find'):
+        if request.get('subcommand') == 'close':
+            return {"closed": True}
+        result = {key: request.get(key) for key in ('source_account', 'destination_account', 'destination_amount')}
+        result.update(alternatives=[_alternative(i) for i in range(3)], full_reply=False)
+        return result
+    if command == 'submit':
+        blob = bytes.fromhex(request.get('tx_blob', ''))
+        return {
+            "accepted": True,
+            "engine_result": "tesSUCCESS",
+            "engine_result_code": 0,
+            "tx_blob": request.get('tx_blob'),
+            "tx_json": {"Account": ACCOUNT, "hash": submitted_hash(blob)},
+        }
+    if command == 'book_offers':
+        return {"ledger_index": 62744197, "offers": [_offer(i) for i in range(limit)], "validated": True}
+    return {}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.request.makefile('rb')
+        self.deflater = None
+        if not self._handshake():
+            return
+        while True:
+            frame = self._recv_frame()
+            if frame is None:
+                return
+            opcode, data = frame
+            if opcode == _OPCODE_CLOSE:
+                self._send_frame(_OPCODE_CLOSE, data[:2])
+                return
+            if opcode == _OPCODE_PING:
+                self._send_frame(_OPCODE_PONG, data)
+            elif opcode == _OPCODE_TEXT:
+                self._on_request(json.loads(data))
+
+    def _handshake(self):
+        headers = dict()
+        self.reader.readline()
+        for line in iter(self.reader.readline, b'\r\n'):
+            if not line:
+                return False
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'].encode() + _GUID).digest())
+        response = [
+            'HTTP/1.1 101 Switching Protocols',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            f'Sec-WebSocket-Accept: {accept.decode()}',
+        ]
+        if self.server.compression and 'permessage-deflate' in headers.get('sec-websocket-extensions', ''):
+            self.deflater = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+            response.append('Sec-WebSocket-Extensions: permessage-deflate')
+        self._write(('\r\n'.join(response) + '\r\n\r\n').encode())
+        return True
+
+    def _recv_frame(self):
+        header = self.reader.read(2)
+        if len(header) < 2:
+            return None
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self.reader.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.reader.read(8))[0]
+        mask = self.reader.read(4) if header[1] & 0x80 else b''
+        data = self.reader.read(length)
+        if mask:
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        return opcode, data
+
+    def _send_frame(self, opcode, data, rsv1=False):
+        length = len(data)
+        b1 = 0x80 | (0x40 if rsv1 else 0) | opcode
+        if length < 126:
+            header = struct.pack('!BB', b1, length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', b1, 126, length)
+        else:
+            header = struct.pack('!BBQ', b1, 127, length)
+        self._write(header + data)
+
+    def _send_text(self, message):
+        data = json.dumps(message).encode()
+        if self.deflater is None:
+            self._send_frame(_OPCODE_TEXT, data)
+            return
+        data = self.deflater.compress(data) + self.deflater.flush(zlib.Z_SYNC_FLUSH)
+        self._send_frame(_OPCODE_TEXT, data[:-4], rsv1=True)
+
+    def _write(self, data):
+        self.request.sendall(data)
+        with self.server.bytes_sent.get_lock():
+            self.server.bytes_sent.value += len(data)
+
+    def _on_request(self, request):
+        if request.get('command') not in COMMANDS:
+            self._send_text({
+                "error": "unknownCmd",
+                "error_message": "Unknown method.",
+                "id": request.get('id'),
+                "request": request,
+                "status": "error",
+                "type": "response",
+            })
+            return
+        self._send_text({
+            "id": request.get('id'),
+            "result": result_for(request),
+            "status": "success",
+            "type": "response",
+        })
+        if request.get('command') == 'submit':
+            # validated straight away, a real network takes a ledger or two
+            self._send_text({
+                "engine_result": "tesSUCCESS",
+                "ledger_index": 62744198,
+                "transaction": {"Account": ACCOUNT, "hash": submitted_hash(bytes.fromhex(request['tx_blob']))},
+                "type": "transaction",
+                "validated": True,
+            })
+        if request.get('command') == 'path_find' and request.get('subcommand') == 'create':
+            # rippled keeps sending updates with the request id as paths improve
+            for _ in range(self.server.path_find_updates):
+                self._send_text(dict(result_for(request), id=request.get('id'), type='path_find'))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _serve(port, compression, path_find_updates, bytes_sent, ready):
+    with _Server(('127.0.0.1', port), _Handler) as server:
+        server.compression = compression
+        server.path_find_updates = path_find_updates
+        server.bytes_sent = bytes_sent
+        ready.send(server.server_address[1])
+        server.serve_forever()
+
+
+class LocalXRPLServer:
+    '''
+    Handle on a server process
+    `bytes_sent` counts every byte the server wrote, handshake and frame headers included
+    '''
+
+    def __init__(self, port=0, compression=False, path_find_updates=3):
+        self.port = port
+        self.compression = compression
+        self.path_find_updates = path_find_updates
+        self._bytes_sent = multiprocessing.Value('Q', 0)
+        self._process = None
+
+    @property
+    def url(self):
+        return f'ws://127.0.0.1:{self.port}'
+
+    @property
+    def bytes_sent(self):
+        return self._bytes_sent.value
+
+    def start(self):
+        ready, child = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(self.port, self.compression, self.path_find_updates, self._bytes_sent, child),
+            daemon=True,
+        )
+        self._process.start()
+        self.port = ready.recv()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
@@ -0,0 +1,240 @@
+'''
+Offline parse / dispatch harness for XRPLWebsocketClient._on_message
+
+Feeds the frame corpus in benchmarks/fixtures/frames through the client's
+message path with no socket at all:
+    responses/  replies to On-Demand requests, the request is registered first
+                so the real handler runs (file name = command)
+    errors/     error replies, registered the same way when they carry an id
+    streams/    subscription stream messages of every type
+
+Perf mode reports, per frame, the json decode cost and the dispatch cost
+(everything `_on_message` does after decoding).
+
+Fuzz mode mutates the corpus (missing `id`, unknown `type`, error replies,
+odd id types, non-object JSON, truncated and corrupted frames) and checks that
+    - nothing escapes as a BaseException the callback wrapper can't catch,
+        which would kill the socket thread
+    - every request that got any reply, success or error, has left the pending table
+Exceptions that the wrapper does catch are listed too: the frame is lost but the socket lives.
+
+Run from the repo root:
+
+    python -m benchmarks.message_harness --iterations 200
+    python -m benchmarks.message_harness --fuzz 2000 --seed 7
+'''
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from collections import Counter
+
+from logger import logger
+from socket_clients.xrpl_socket import XRPLWebsocketClient
+
+
+FRAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'frames')
+ACCOUNT = 'rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3'
+ISSUER = 'rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B'
+
+
+def load_corpus(frames_dir=FRAMES_DIR):
+    '''
+    {category: {name: raw frame text}}
+    '''
+    corpus = dict()
+    for category in sorted(os.listdir(frames_dir)):
+        path = os.path.join(frames_dir, category)
+        corpus[category] = dict()
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith('.json'):
+                with open(os.path.join(path, file_name)) as f:
+                    corpus[category][file_name[:-len('.json')]] = f.read().strip()
+    return corpus
+
+
+class OfflineClient(XRPLWebsocketClient):
+    '''
+    Never connects, sent messages are only counted
+    '''
+
+    def __init__(self) -> None:
+        super().__init__(stream_url='ws://offline')
+        self.ws = object()
+        self.sent = 0
+        self.on_message = self._wrap_callback(self._on_message)
+
+    def send_json(self, message):
+        self.sent += 1
+
+    def register(self, command, _id):
+        '''
+        Registers a pending request through the real API method where there is one
+        '''
+        if command == 'ping':
+            self.ping(_id)
+        elif command == 'random':
+            self.random(_id)
+        elif command == 'account_info':
+            self.account_info(dict(account=ACCOUNT, id=_id))
+        elif command == 'account_lines':
+            self.account_lines(dict(account=ACCOUNT, id=_id))
+        elif command == 'book_offers':
+            self.book_offers(dict(
+                id=_id, taker_gets=dict(currency='XRP'), taker_pays=dict(currency='USD', issuer=ISSUER)))
+        elif command == 'subscribe':
+            self.subscribe(dict(id=_id, streams=['ledger']))
+        elif command == 'path_find':
+            self.path_find(dict(
+                id=_id, subcommand='create', source_account=ACCOUNT,
+                destination_account=ISSUER, destination_amount='1000000'))
+        else:
+            self.send_request(dict(command=command, id=_id, handler=lambda message: None))
+
+
+def _command_for(category, name, frame):
+    if category == 'responses':
+        return name
+    if isinstance(frame, dict) and isinstance(frame.get('request'), dict):
+        return frame['request'].get('command')
+    return None
+
+
+def perf(corpus, iterations):
+    client = OfflineClient()
+    rows = list()
+    for category, frames in corpus.items():
+        for name, raw in frames.items():
+            frame = json.loads(raw)
+            command = _command_for(category, name, frame)
+            _id = frame.get('id')
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                json.loads(raw)
+            parse = (time.perf_counter() - start) / iterations
+
+            total = 0.0
+            for _ in range(iterations):
+                if command and _id is not None:
+                    client.register(command, _id)
+                start = time.perf_counter()
+                client.on_message(client.ws, raw)
+                total += time.perf_counter() - start
+            total /= iterations
+
+            rows.append((f'{category}/{name}', len(raw), parse, max(total - parse, 0.0), total))
+
+    print(f'{"frame":<36} {"bytes":>8} {"parse us":>10} {"dispatch us":>12} {"msgs/s":>10}')
+    for name, size, parse, dispatch, total in rows:
+        print(f'{name:<36} {size:>8,} {parse * 1e6:>10.1f} {dispatch * 1e6:>12.1f} {1 / total:>10,.0f}')
+    print(f'pending requests left: {len(client._response_queue)}')
+
+
+def _mutations(corpus, rng):
+    '''
+    Yields (kind, raw frame, (command, id) to register or None)
+    '''
+    frames = [
+        (category, name, json.loads(raw), raw)
+        for category, named in corpus.items() for name, raw in named.items()
+    ]
+    while True:
+        category, name, frame, raw = rng.choice(frames)
+        command = _command_for(category, name, frame)
+        kind = rng.choice((
+            'missing_id', 'unknown_type', 'error_reply', 'odd_id', 'non_object',
+            'truncated', 'corrupted', 'missing_field', 'empty',
+        ))
+        mutated = dict(frame)
+        register = (command, frame.get('id')) if command and frame.get('id') is not None else None
+
+        if kind == 'missing_id':
+            mutated.pop('id', None)
+            register = None
+        elif kind == 'unknown_type':
+            # without type == response it isn't a reply, so nothing gets answered
+            mutated['type'] = rng.choice(('bogusType', '', None, 5, ['response']))
+            register = None
+        elif kind == 'error_reply':
+            mutated = dict(id=frame.get('id'), error='internal', error_code=73, status='error', type='response')
+        elif kind == 'odd_id':
+            mutated['id'] = rng.choice((None, {'a': 1}, [1, 2], 1.5, True, ''))
+            register = None
+        elif kind == 'non_object':
+            yield kind, json.dumps(rng.choice(([], [frame], 'response', 1, None))), None
+            continue
+        elif kind == 'truncated':
+            yield kind, raw[:rng.randrange(len(raw))], None
+            continue
+        elif kind == 'corrupted':
+            chars = list(raw)
+            for _ in range(rng.randint(1, 5)):
+                chars[rng.randrange(len(chars))] = rng.choice('{}[]":,x\\0 ')
+            yield kind, ''.join(chars), None
+            continue
+        elif kind == 'missing_field':
+            keys = [k for k in mutated if k not in ('id', 'type')]
+            if keys:
+                mutated.pop(rng.choice(keys))
+        elif kind == 'empty':
+            yield kind, '', None
+            continue
+        yield kind, json.dumps(mutated), register
+
+
+def fuzz(corpus, count, seed):
+    rng = random.Random(seed)
+    client = OfflineClient()
+    kinds = Counter()
+    raised = Counter()
+    fatal = Counter()
+    answered = set()
+
+    mutations = _mutations(corpus, rng)
+    for _ in range(count):
+        kind, raw, register = next(mutations)
+        kinds[kind] += 1
+        if register:
+            client.register(*register)
+            answered.add(register[1])
+        try:
+            client._on_message(client.ws, raw)
+        except Exception as e:
+            raised[(kind, type(e).__name__)] += 1
+        except BaseException as e:
+            fatal[(kind, type(e).__name__)] += 1
+
+    leaked = [_id for _id in answered if _id in client._response_queue]
+    print(f'{count} fuzzed frames (seed {seed}): ' + ', '.join(f'{k} {n}' for k, n in sorted(kinds.items())))
+    print(f'caught by the callback wrapper (frame dropped, socket fine): {sum(raised.values())}')
+    for (kind, error), n in sorted(raised.items()):
+        print(f'    {kind:<14} {error:<20} {n}')
+    print(f'would kill the socket thread: {sum(fatal.values())}')
+    for (kind, error), n in sorted(fatal.items()):
+        print(f'    {kind:<14} {error:<20} {n}')
+    print(f'answered requests still pending: {len(leaked)}')
+    return not fatal and not leaked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200, help='dispatches per frame in perf mode')
+    parser.add_argument('--fuzz', type=int, default=0, help='number of fuzzed frames, skips perf mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frames', default=FRAMES_DIR, help='corpus directory')
+    args = parser.parse_args()
+
+    # handlers log every message, keep the terminal readable
+    logger.setLevel(logging.CRITICAL)
+    corpus = load_corpus(args.frames)
+    if args.fuzz:
+        sys.exit(0 if fuzz(corpus, args.fuzz, args.seed) else 1)
+    perf(corpus, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+'''
+Contention benchmark for the pending request table
+
+N producer threads register requests (like `ping`, `account_info`, ... do)
+while one reader thread pops them as responses would, plus a sweeper
+running `expire` the way `stale_response_queue_check` does.
+Compares a plain dict behind one global lock with PendingRequests at a
+few shard counts. Run from the repo root:
+
+    python -m benchmarks.pending_requests_benchmark --producers 8 --requests 50000
+
+On a GIL build the threads take turns, and more shards measure slower
+(8 producers x 20000: about 0.55-0.8s for the global lock, 0.75-0.95s for
+1 shard, 1.3-2s for 16 shards), which is why PendingRequests defaults to
+1 shard there.
+The sharded default is for free-threaded builds.
+'''
+import sys
+import time
+import argparse
+from threading import Thread, Lock, Event
+
+from socket_clients.pending_requests import PendingRequests
+
+
+class GlobalLockTable:
+    '''
+    Baseline: one dict, one lock for everything
+    '''
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._table = dict()
+
+    def add(self, payload):
+        payload.setdefault('sent_time', time.time())
+        with self._lock:
+            self._table[payload['id']] = payload
+
+    def pop(self, _id):
+        with self._lock:
+            return self._table.pop(_id, None)
+
+    def expire(self, older_than):
+        cutoff = time.time() - older_than
+        with self._lock:
+            stale = [_id for _id, req in self._table.items() if req['sent_time'] < cutoff]
+            return [self._table.pop(_id) for _id in stale]
+
+
+def run(table, producers, requests):
+    ids = [[f'{p}-{i}' for i in range(requests)] for p in range(producers)]
+    done = Event()
+
+    def produce(own_ids):
+        for _id in own_ids:
+            table.add(dict(id=_id, command='ping'))
+
+    def consume():
+        # responses come back roughly in send order per producer
+        remaining = [list(reversed(own_ids)) for own_ids in ids]
+        while any(remaining):
+            for own_ids in remaining:
+                if own_ids and table.pop(own_ids[-1]) is not None:
+                    own_ids.pop()
+
+    def sweep():
+        while not done.is_set():
+            table.expire(60)
+            time.sleep(0.01)
+
+    threads = [Thread(target=produce, args=(own_ids,)) for own_ids in ids]
+    reader = Thread(target=consume)
+    sweeper = Thread(target=sweep)
+    start = time.perf_counter()
+    for t in threads + [reader, sweeper]:
+        t.start()
+    for t in threads + [reader]:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    sweeper.join()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--producers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50000, help='requests per producer')
+    args = parser.parse_args()
+
+    total = args.producers * args.requests
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f'{args.producers} producers x {args.requests} requests, GIL {"on" if gil else "off"}')
+    print(f'{"table":<24} {"seconds":>10} {"ops/s":>14}')
+    tables = [('dict + global lock', GlobalLockTable())]
+    tables += [('PendingRequests()', PendingRequests())]
+    tables += [(f'PendingRequests({n})', PendingRequests(shards=n)) for n in (1, 16, 64)]
+    for name, table in tables:
+        elapsed = run(table, args.producers, args.requests)
+        # one add and one pop per request
+        print(f'{name:<24} {elapsed:>10.3f} {2 * total / elapsed:>14,.0f}')
+
+
+if __name__ == '__main__':
+    main()
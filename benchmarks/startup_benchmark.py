@@ -0,0 +1,84 @@
+'''
+Cold start: time to first response for a short lived job
+
+Runs fresh interpreters against benchmarks/local_server.py and reports
+    - the bare interpreter start, for reference
+    - `python cli.py ping` from spawn to exit
+    - inside the process: importing the client, then the first request
+        (connect + handshake + round trip)
+
+Run from the repo root:
+
+    python -m benchmarks.startup_benchmark --runs 20
+'''
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.local_server import LocalXRPLServer
+
+
+def probe(url):
+    '''
+    Runs inside the child process
+    '''
+    from threading import Event
+
+    t0 = time.perf_counter()
+    from socket_clients.xrpl_socket import XRPLWebsocketClient
+    from commons import utils
+    imported = time.perf_counter()
+
+    done = Event()
+    xrpl = XRPLWebsocketClient(stream_url=url)
+    xrpl.send_request(dict(command='ping', id=utils.generate_uuid(), handler=lambda message: done.set()))
+    done.wait(10)
+    responded = time.perf_counter()
+    xrpl.close()
+    print(json.dumps(dict(import_ms=(imported - t0) * 1000, first_response_ms=(responded - imported) * 1000)))
+
+
+def _timed(cmd):
+    start = time.perf_counter()
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return (time.perf_counter() - start) * 1000, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--probe', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe)
+        return
+
+    server = LocalXRPLServer().start()
+    try:
+        interpreter, cli, imports, first = [], [], [], []
+        for _ in range(args.runs):
+            interpreter.append(_timed([sys.executable, '-c', 'pass'])[0])
+            cli.append(_timed([sys.executable, 'cli.py', 'ping', '--url', server.url])[0])
+            out = _timed([sys.executable, '-m', 'benchmarks.startup_benchmark', '--probe', server.url])[1]
+            result = json.loads(out)
+            imports.append(result['import_ms'])
+            first.append(result['first_response_ms'])
+    finally:
+        server.stop()
+
+    print(f'{args.runs} runs, median / max in ms')
+    for name, values in (
+        ('interpreter start', interpreter),
+        ('cli.py ping, spawn to exit', cli),
+        ('import client', imports),
+        ('connect + first response', first),
+    ):
+        print(f'{name:<28} {statistics.median(values):>8.1f} {max(values):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+One-shot XRPL request from the command line
+
+Connects, sends a single command the moment the handshake completes, prints
+the result as JSON and exits. Meant for cron checks and quick balance probes.
+
+    python cli.py ping
+    python cli.py account_info account=rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3
+    python cli.py account_lines account=rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3 limit=5
+    python cli.py server_info --url wss://xrplcluster.com
+
+Fields are key=value, values that parse as JSON (numbers, true, {...}) are sent as such.
+Exit code is 0 on success, 1 on an error response, 2 on timeout.
+'''
+import sys
+import json
+import argparse
+from threading import Event
+
+
+DEFAULT_URL = 'wss://s.altnet.rippletest.net:51233'
+
+
+def _field(pair):
+    key, sep, value = pair.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'expected key=value, got {pair!r}')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def request(url, command, fields, timeout=10):
+    '''
+    Sends one command and returns (response, ok), response is None on timeout
+    '''
+    # imported here so `--help` and bad arguments exit without loading the client
+    from socket_clients.xrpl_socket import XRPLWebsocketClient
+    from commons import utils
+
+    done = Event()
+    reply = dict()
+
+    def on_response(message):
+        reply.update(message=message, ok=True)
+        done.set()
+
+    def on_error(message):
+        reply.update(message=message, ok=False)
+        done.set()
+
+    xrpl = XRPLWebsocketClient(stream_url=url)
+    payload = dict(fields, command=command, id=utils.generate_uuid())
+    payload.update(handler=on_response, error_handler=on_error)
+    try:
+        xrpl.connect(timeout)
+        xrpl.send_request(payload)
+        done.wait(timeout)
+    finally:
+        xrpl.close()
+    return reply.get('message'), reply.get('ok', False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', help='any websocket API command, e.g. ping, account_info, fee')
+    parser.add_argument('fields', nargs='*', type=_field, help='request fields as key=value')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--verbose', action='store_true', help='log like main.py does')
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        from logger import setup_logging
+        setup_logging()
+
+    try:
+        message, ok = request(args.url, args.command, dict(args.fields), args.timeout)
+    except TimeoutError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if message is None:
+        print(f'No response from {args.url} within {args.timeout}s', file=sys.stderr)
+        return 2
+    print(json.dumps(message.get('result', message), indent=2))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,16 @@
 import uuid
 import time
 import json
+import itertools
+
+
+_counter = itertools.count()
 
 
 def generate_uuid(seed=''):
     if not seed:
-        seed = str(int(time.time()))
+        # unique per call, requests sent within the same second must not share an id
+        seed = f'{time.time()}-{next(_counter)}'
     if not type(seed) is str:
         seed = json.dumps(seed)
     return uuid.uuid5(uuid.NAMESPACE_OID, seed).hex
@@ -3,10 +3,16 @@ import logging
 SPACING = '\n' * 2
 LOG_FORMAT = f'%(threadName)s | %(filename)s | %(lineno)d | %(asctime)s | %(levelname)s | %(message)s {SPACING}'
 
-logging.basicConfig(
-    level=logging.INFO,
-    format=LOG_FORMAT,
-    )
-
 logFormatter = logging.Formatter(LOG_FORMAT)
-logger = logging.getLogger()
\ No newline at end of file
+logger = logging.getLogger()
+
+
+def setup_logging(level=logging.INFO):
+    '''
+    Configures the root logger. Entry points (main.py, cli.py) call this,
+    importing the client doesn't, so quick jobs and other apps keep control of logging
+    '''
+    logging.basicConfig(
+        level=level,
+        format=LOG_FORMAT,
+        )
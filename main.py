@@ -3,7 +3,7 @@ import json
 from time import sleep
 from threading import Thread
 
-from logger import logger
+from logger import logger, setup_logging
 from socket_clients.xrpl_socket import XRPLWebsocketClient
 
 
@@ -26,8 +26,8 @@ def Main():
     '''
     try:
         logger.info(f'Connecting XRPL Sockets')
+        # connects on the first request, which goes out as soon as the handshake is done
         xrpl = XRPLWebsocketClient(stream_url='wss://s.altnet.rippletest.net:51233')
-        sleep(1)
         
         logger.info('Opening Ping\n')
         xrpl.ping()
@@ -78,6 +78,7 @@ def Main():
 
 
 if __name__ == '__main__':
+    setup_logging()
     main_thread = Thread(name='MAIN', target=Main)
     main_thread.start()
     
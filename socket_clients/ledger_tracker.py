@@ -0,0 +1,186 @@
+import math
+from collections import deque
+from threading import Lock
+from typing import Dict, List, Optional
+
+from logger import logger
+
+
+class LedgerSnapshot:
+    '''
+    Everything the streams told us about one closed ledger
+
+    reserve_base / reserve_inc / fee_base are in drops, straight from `ledgerClosed`.
+    load_factor / load_base are the latest `serverStatus` values when the ledger closed.
+    books maps 'currency_a/currency_b' to the bookChanges OHLC and volumes, values kept as the server's strings.
+    '''
+    __slots__ = (
+        'ledger_index', 'ledger_hash', 'ledger_time', 'txn_count',
+        'fee_base', 'reserve_base', 'reserve_inc',
+        'load_factor', 'load_base', 'books',
+    )
+
+    def __init__(self, ledger_index: int) -> None:
+        self.ledger_index = ledger_index
+        self.ledger_hash = None
+        self.ledger_time = None
+        self.txn_count = None
+        self.fee_base = None
+        self.reserve_base = None
+        self.reserve_inc = None
+        self.load_factor = None
+        self.load_base = None
+        self.books: Dict[str, Dict] = dict()
+
+    @property
+    def fee(self) -> Optional[int]:
+        '''
+        Base fee scaled by server load, in drops
+        The least a transaction should pay to get in without queueing
+        '''
+        if self.fee_base is None:
+            return None
+        if not self.load_factor or not self.load_base:
+            return self.fee_base
+        return math.ceil(self.fee_base * self.load_factor / self.load_base)
+
+    def as_dict(self) -> Dict:
+        snapshot = {k: getattr(self, k) for k in self.__slots__}
+        snapshot['fee'] = self.fee
+        return snapshot
+
+    def __repr__(self) -> str:
+        return f'<LedgerSnapshot {self.ledger_index} fee={self.fee} load={self.load_factor}/{self.load_base}>'
+
+
+class LedgerTracker:
+    '''
+    Docs:
+        https://xrpl.org/subscribe.html#ledger-stream
+        https://xrpl.org/subscribe.html#server-stream
+        https://xrpl.org/subscribe.html#book-changes-stream
+
+    Description:
+        Folds the `ledger`, `server` and `book_changes` streams into one
+        LedgerSnapshot per closed ledger, kept in a bounded ring buffer
+        (the last `history` ledgers).
+
+        Reserves, fee and load come for free with every ledger close, so read
+        them from here instead of sending `server_info` / `fee` each ledger.
+
+    Example:
+        >>> xrpl.ledgers.start()
+        >>> xrpl.ledgers.latest().fee
+        >>> xrpl.ledgers.get(62744488).books['USD.rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B/XRP_drops']
+    '''
+    STREAMS = ['ledger', 'server', 'book_changes']
+
+    def __init__(self, client, history: int = 256) -> None:
+        self.client = client
+        self.lock = Lock()
+        self._snapshots = deque(maxlen=history)
+        self._server_status: Dict = dict()
+
+
+    def start(self) -> None:
+        '''
+        Subscribes to the streams. The subscribe response seeds the first snapshot
+        '''
+        self.client.subscribe(dict(streams=self.STREAMS), handler=self.on_subscribed, internal=True)
+
+
+    def latest(self) -> Optional[LedgerSnapshot]:
+        with self.lock:
+            return self._snapshots[-1] if self._snapshots else None
+
+
+    def get(self, ledger_index: int) -> Optional[LedgerSnapshot]:
+        with self.lock:
+            return self._find(ledger_index)
+
+
+    def history(self) -> List[LedgerSnapshot]:
+        with self.lock:
+            return list(self._snapshots)
+
+
+    def _find(self, ledger_index: int) -> Optional[LedgerSnapshot]:
+        # ledgers are appended in order, so count back from the newest
+        if not self._snapshots:
+            return None
+        offset = self._snapshots[-1].ledger_index - ledger_index
+        if 0 <= offset < len(self._snapshots):
+            snapshot = self._snapshots[-1 - offset]
+            if snapshot.ledger_index == ledger_index:
+                return snapshot
+        for snapshot in self._snapshots:
+            if snapshot.ledger_index == ledger_index:
+                return snapshot
+        return None
+
+
+    def _snapshot(self, ledger_index: int) -> Optional[LedgerSnapshot]:
+        '''
+        Snapshot for a ledger, created if it's newer than anything we have
+        Returns None for ledgers already pushed out of the ring
+        '''
+        snapshot = self._find(ledger_index)
+        if snapshot is None and (not self._snapshots or ledger_index > self._snapshots[-1].ledger_index):
+            snapshot = LedgerSnapshot(ledger_index)
+            self._snapshots.append(snapshot)
+        return snapshot
+
+
+    def on_subscribed(self, message: Dict) -> None:
+        '''
+        The subscribe response carries the current ledger and server state
+        '''
+        logger.info(f'Ledger Tracker Subscribed: {message}')
+        result = message.get('result', dict())
+        if 'load_factor' in result:
+            self.on_server_status(result)
+        if 'ledger_index' in result:
+            self.on_ledger_closed(result)
+
+
+    def on_ledger_closed(self, message: Dict) -> None:
+        if not isinstance(message.get('ledger_index'), int):
+            return
+        with self.lock:
+            snapshot = self._snapshot(message['ledger_index'])
+            if snapshot is None:
+                return
+            for field in ('ledger_hash', 'ledger_time', 'txn_count', 'fee_base', 'reserve_base', 'reserve_inc'):
+                if field in message:
+                    setattr(snapshot, field, message[field])
+            snapshot.load_factor = self._server_status.get('load_factor')
+            snapshot.load_base = self._server_status.get('load_base')
+
+
+    def on_server_status(self, message: Dict) -> None:
+        '''
+        serverStatus only comes when the load changes, so it applies to
+        the newest ledger and every ledger after it
+        '''
+        with self.lock:
+            self._server_status = dict(
+                load_factor=message.get('load_factor'),
+                load_base=message.get('load_base'),
+            )
+            if self._snapshots:
+                self._snapshots[-1].load_factor = self._server_status['load_factor']
+                self._snapshots[-1].load_base = self._server_status['load_base']
+
+
+    def on_book_changes(self, message: Dict) -> None:
+        if not isinstance(message.get('ledger_index'), int):
+            return
+        with self.lock:
+            snapshot = self._snapshot(message['ledger_index'])
+            if snapshot is None:
+                return
+            if snapshot.ledger_time is None:
+                snapshot.ledger_time = message.get('ledger_time')
+            for change in message.get('changes', []):
+                pair = f"{change.get('currency_a')}/{change.get('currency_b')}"
+                snapshot.books[pair] = {k: change.get(k) for k in ('open', 'high', 'low', 'close', 'volume_a', 'volume_b')}
@@ -0,0 +1,224 @@
+import re
+import json
+import time
+from threading import Lock
+from typing import Dict, Optional
+
+from commons import utils
+from logger import logger
+
+
+# Async path_find updates are recognised (and matched to their session) without a json decode
+PATH_FIND_UPDATE = re.compile(r'"type"\s*:\s*"path_find"')
+_REQUEST_ID = re.compile(r'"id"\s*:\s*"([0-9a-f]+)"')
+
+
+def session_key(source_account, destination_account, destination_amount, send_max=None, **options) -> str:
+    '''
+    Callers asking for the same source/destination/amount and options share a session
+    Amounts can be dicts, so the key is their canonical json
+    '''
+    return json.dumps([source_account, destination_account, destination_amount, send_max, options], sort_keys=True)
+
+
+class PathFindSession:
+    '''
+    One path_find request and the latest quote for it
+
+    Only the newest server update is kept, as the raw frame. It is decoded the
+    first time somebody reads it, so updates that get superseded before anyone
+    looks at them are never decoded at all (counted in `discarded`).
+
+    The socket thread writes and callers read, so the swaps happen under `lock`.
+    The decode itself runs outside it.
+    '''
+
+    def __init__(self, key, request: Dict) -> None:
+        self.key = key
+        self.request = request
+        self.id = request['id']
+        self.refcount = 1
+        self.updates = 0
+        self.discarded = 0
+        self.updated_time = None
+        self._raw: Optional[str] = None
+        self._latest: Optional[Dict] = None
+        self.lock = Lock()
+
+    def _set_raw(self, raw_message: str) -> None:
+        with self.lock:
+            if self._raw is not None:
+                self.discarded += 1
+            self._raw = raw_message
+            self.updates += 1
+            self.updated_time = time.time()
+
+    def _set_decoded(self, message: Dict) -> None:
+        with self.lock:
+            self._raw = None
+            self._latest = message
+            self.updates += 1
+            self.updated_time = time.time()
+
+    def latest(self) -> Optional[Dict]:
+        '''
+        Latest path_find result for this session, or None before the first one
+        '''
+        with self.lock:
+            raw, self._raw = self._raw, None
+            updates = self.updates
+            if raw is None:
+                return self._latest
+
+        latest = json.loads(raw)
+        with self.lock:
+            # anything that landed during the decode is newer, keep it
+            if self.updates == updates:
+                self._latest = latest
+        return latest
+
+    @property
+    def alternatives(self):
+        latest = self.latest() or dict()
+        return latest.get('result', latest).get('alternatives', [])
+
+
+class PathFindSessions:
+    '''
+    Docs:
+        https://xrpl.org/path_find.html
+        https://xrpl.org/ripple_path_find.html
+
+    Description:
+        Manages path_find sessions for an XRPLWebsocketClient
+
+        rippled only keeps one path_find open per connection, a new `create`
+        replaces the old one. So:
+            - the most recently opened session is the live one on the server
+                and gets continuous updates
+            - older open sessions are paused, they keep their last quote and
+                can be refreshed with one-shot `ripple_path_find` calls (`refresh`)
+            - closing the live session resumes the most recently opened paused one
+
+        Identical requests from different callers share one session (refcounted),
+        so the server only computes each set of paths once.
+
+    Example:
+        >>> session = xrpl.path_finds.open('rSource...', 'rDest...', '1000000')
+        >>> session.alternatives
+        >>> xrpl.path_finds.close(session)
+    '''
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.lock = Lock()
+        self.sessions: Dict[str, PathFindSession] = dict()
+        self._by_id: Dict[str, PathFindSession] = dict()
+        self.active: Optional[PathFindSession] = None
+
+
+    def open(self, source_account, destination_account, destination_amount, send_max=None, **options) -> PathFindSession:
+        '''
+        Opens (or joins) a session and makes it the live one on the server
+        Extra options (paths, domain, ...) go into the request as-is
+        '''
+        key = session_key(source_account, destination_account, destination_amount, send_max, **options)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session:
+                session.refcount += 1
+                return session
+
+            request = dict(
+                id=utils.generate_uuid(),
+                source_account=source_account,
+                destination_account=destination_account,
+                destination_amount=destination_amount,
+            )
+            if send_max is not None:
+                request['send_max'] = send_max
+            request.update(options)
+
+            session = PathFindSession(key, request)
+            self.sessions[key] = session
+            self._by_id[session.id] = session
+            self._activate(session)
+        return session
+
+
+    def update(self, session: PathFindSession, **changes) -> PathFindSession:
+        '''
+        Changes the amount/accounts/options of a session, the options it was opened with carry over
+        Other callers sharing it keep the old one, so this returns the session you should use now
+        '''
+        params = {k: v for k, v in session.request.items() if k != 'id'}
+        params.update(changes)
+        self.close(session)
+        return self.open(**params)
+
+
+    def close(self, session: PathFindSession) -> None:
+        '''
+        Releases a caller's handle. The session goes away when its last caller closes it
+        '''
+        with self.lock:
+            session.refcount -= 1
+            if session.refcount > 0 or self.sessions.get(session.key) is not session:
+                return
+            del self.sessions[session.key]
+            del self._by_id[session.id]
+
+            if session is self.active:
+                self.active = None
+                self.client.path_find(dict(id=utils.generate_uuid(), subcommand='close'))
+                if self.sessions:
+                    # dicts keep insertion order, the last one is the most recently opened
+                    self._activate(list(self.sessions.values())[-1])
+
+
+    def close_all(self) -> None:
+        with self.lock:
+            self.sessions.clear()
+            self._by_id.clear()
+            if self.active is not None:
+                self.active = None
+                self.client.path_find(dict(id=utils.generate_uuid(), subcommand='close'))
+
+
+    def refresh(self) -> None:
+        '''
+        One-shot `ripple_path_find` for every paused session
+        Call it on whatever cadence you need, ledger closes are a good one
+        '''
+        with self.lock:
+            paused = [s for s in self.sessions.values() if s is not self.active]
+        for session in paused:
+            request = {k: v for k, v in session.request.items() if k != 'id'}
+            request['id'] = utils.generate_uuid()
+            self.client.ripple_path_find(request, handler=self._response_handler(session))
+
+
+    def _activate(self, session: PathFindSession) -> None:
+        self.active = session
+        request = dict(session.request, subcommand='create')
+        self.client.path_find(request, handler=self._response_handler(session))
+
+
+    def _response_handler(self, session: PathFindSession):
+        def handler(message):
+            if self._by_id.get(session.id) is session:
+                session._set_decoded(message)
+        return handler
+
+
+    def on_update(self, raw_message: str) -> None:
+        '''
+        Called from the socket thread for every async `path_find` frame
+        '''
+        match = _REQUEST_ID.search(raw_message)
+        session = self._by_id.get(match.group(1)) if match else None
+        if session is None or session is not self.active:
+            # late update for a session that was closed or replaced
+            logger.debug('Dropping path_find update for an inactive session')
+            return
+        session._set_raw(raw_message)
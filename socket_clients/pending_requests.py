@@ -0,0 +1,94 @@
+import sys
+import time
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class PendingRequests:
+    '''
+    Table of On-Demand requests waiting for their response
+
+    Written by any number of caller threads (`add`) and drained by the websocket
+    thread (`pop`). Entries are spread over `shards` dicts by id hash, each with
+    its own lock, so callers and the reader only contend when they hit the same shard.
+
+    With the GIL the threads take turns anyway and extra shards only cost time:
+    benchmarks/pending_requests_benchmark.py (8 producers) has 1 shard within
+    ~15% of a plain dict behind one lock, and 16 shards about 2x slower. So the
+    default is 1 shard, and 16 only on free-threaded builds where the locks are
+    what keeps threads apart.
+
+    `add` has to happen before the request is sent, otherwise a fast response
+    can arrive before its entry exists.
+
+    Sweeps (`expire`) take one shard lock at a time, so they never iterate a
+    dict that is being changed underneath them.
+    '''
+
+    def __init__(self, shards: Optional[int] = None) -> None:
+        if shards is None:
+            shards = 1 if getattr(sys, '_is_gil_enabled', lambda: True)() else 16
+        if shards < 1 or shards & (shards - 1):
+            raise ValueError('shards must be a power of 2')
+        self._mask = shards - 1
+        self._shards: List[Tuple[Dict[Any, Dict], Lock]] = [(dict(), Lock()) for _ in range(shards)]
+
+    def add(self, payload: Dict) -> Optional[Dict]:
+        '''
+        Registers a request by its `id` and stamps `sent_time`
+        Returns the entry it replaced if that id was already pending
+        '''
+        _id = payload['id']
+        if 'sent_time' not in payload:
+            payload['sent_time'] = time.time()
+        shard, lock = self._shards[hash(_id) & self._mask]
+        with lock:
+            replaced = shard.get(_id)
+            shard[_id] = payload
+        return replaced
+
+    # pop and get pick their shard inline, they run once per response on the socket thread
+
+    def pop(self, _id) -> Optional[Dict]:
+        '''
+        Removes and returns the request, None if it isn't pending
+        '''
+        try:
+            shard, lock = self._shards[hash(_id) & self._mask]
+        except TypeError:
+            # ids off the wire can be anything, an unhashable one was never pending
+            return None
+        with lock:
+            return shard.pop(_id, None)
+
+    def get(self, _id) -> Optional[Dict]:
+        try:
+            shard, lock = self._shards[hash(_id) & self._mask]
+        except TypeError:
+            return None
+        with lock:
+            return shard.get(_id)
+
+    def expire(self, older_than: float) -> List[Dict]:
+        '''
+        Removes and returns requests sent more than `older_than` seconds ago
+        '''
+        cutoff = time.time() - older_than
+        expired = list()
+        for shard, lock in self._shards:
+            with lock:
+                stale = [_id for _id, req in shard.items() if req.get('sent_time', 0) < cutoff]
+                for _id in stale:
+                    expired.append(shard.pop(_id))
+        return expired
+
+    def clear(self) -> None:
+        for shard, lock in self._shards:
+            with lock:
+                shard.clear()
+
+    def __contains__(self, _id) -> bool:
+        return self.get(_id) is not None
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard, _ in self._shards)
@@ -0,0 +1,215 @@
+import re
+import json
+import time
+import zlib
+import multiprocessing
+from typing import Callable, Dict, List
+
+from socket_clients.xrpl_socket import XRPLWebsocketClient
+from socket_clients.shm_ring import ShmRing
+from socket_clients.subscriptions import FrameKeys
+from logger import logger
+
+
+# Cheap routing keys straight off the raw frame, no json decode in the ingest process
+_IS_TRANSACTION = re.compile(r'"type"\s*:\s*"transaction"')
+_TX_ACCOUNT = re.compile(r'"transaction"\s*:\s*\{[^{}]*?"Account"\s*:\s*"(\w+)"')
+_TX_TYPE = re.compile(r'"TransactionType"\s*:\s*"(\w+)"')
+_TX_HASH = re.compile(r'"hash"\s*:\s*"([0-9A-F]{64})"')
+
+SHARD_BY = {
+    'account': (_TX_ACCOUNT, lambda m: m['transaction']['Account']),
+    'transaction_type': (_TX_TYPE, lambda m: m['transaction']['TransactionType']),
+}
+
+
+def log_transaction(message: Dict) -> None:
+    '''
+    Default shard handler
+    '''
+    logger.info(f"Transaction Message: {message['transaction'].get('hash')}")
+
+
+def _run_shard(shard: int, ring: ShmRing, handler: Callable, processed, processed_bytes) -> None:
+    '''
+    Worker process loop
+    Records come out of the ring in the order the ingest process put them in
+    '''
+    while True:
+        frame = ring.get(timeout=1)
+        if frame is None:
+            if ring.closed and not ring.backlog():
+                return
+            continue
+        try:
+            handler(json.loads(frame))
+        except Exception as e:
+            logger.error(f'Shard {shard} handler error: {repr(e)}')
+        processed[shard] += 1
+        processed_bytes[shard] += len(frame)
+
+
+class ShardedStreamRunner(XRPLWebsocketClient):
+    '''
+    Spreads the `transactions` firehose across worker processes
+
+    Summary:
+        - This process owns the socket. Transaction stream frames are never
+            decoded here, only routed: a regex pulls the shard key out of the raw
+            frame and the frame bytes are copied into that shard's shared memory ring
+        - Each of the N workers owns one ring and decodes and handles its frames,
+            so the work is spread over N cores instead of one GIL
+        - Every other message (responses, ledgerClosed, ...) goes through the
+            usual `XRPLWebsocketClient._on_message` path in this process
+        - Transaction frames also go through that path when this process needs
+            them: a `self.subscriptions` transaction consumer's filters accept the
+            raw frame, or it carries the hash of a transaction `submit()` is waiting on
+        - If a worker dies its shard's frames are dropped and counted in `stats()`,
+            the socket thread never waits on a ring nobody reads
+
+        - shard_by='account' keeps each account's transactions in order on one shard
+        - shard_by='transaction_type' keeps each TransactionType in order on one shard
+
+        - `handler` runs in the worker processes, so it has to be picklable
+            (a module level function) and can't touch state in this process
+
+    Example:
+        >>> runner = ShardedStreamRunner(handler=my_handler, workers=4)
+        >>> runner.start()
+        >>> runner.subscribe({'streams': ['transactions']})
+        >>> runner.stats()
+        >>> runner.stop()
+    '''
+
+    def __init__(
+        self,
+        handler: Callable[[Dict], None] = log_transaction,
+        workers: int = multiprocessing.cpu_count(),
+        shard_by: str = 'account',
+        ring_size: int = 8 * 1024 * 1024,
+        **client_options,
+    ) -> None:
+        if shard_by not in SHARD_BY:
+            raise KeyError(f'shard_by must be one of {list(SHARD_BY)}')
+        super().__init__(**client_options)
+        self.handler = handler
+        self.shard_by = shard_by
+        self._key_pattern, self._key_fallback = SHARD_BY[shard_by]
+        self._rings: List[ShmRing] = [ShmRing(ring_size) for _ in range(workers)]
+        self._routed = [0] * workers
+        self._dropped = [0] * workers
+        self._processed = multiprocessing.RawArray('Q', workers)
+        self._processed_bytes = multiprocessing.RawArray('Q', workers)
+        self._workers: List[multiprocessing.Process] = list()
+        self._started = None
+
+
+    def start(self) -> None:
+        '''
+        Starts the worker processes. Call before subscribing to any transaction stream
+        '''
+        for shard, ring in enumerate(self._rings):
+            worker = multiprocessing.Process(
+                name=f'XRPL_SHARD_{shard}',
+                target=_run_shard,
+                args=(shard, ring, self.handler, self._processed, self._processed_bytes),
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+        self._started = time.time()
+
+
+    def stop(self, timeout=10) -> None:
+        '''
+        Closes the rings, lets the workers drain them and joins them
+        '''
+        for ring in self._rings:
+            ring.close()
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.warning(f'{worker.name} did not drain in {timeout}s, terminating')
+                worker.terminate()
+        self._workers = list()
+
+
+    def shard_for(self, raw_message: str) -> int:
+        '''
+        Shard index for a raw transaction frame
+        Falls back to a full decode only when the regex can't find the key
+        '''
+        match = self._key_pattern.search(raw_message)
+        key = match.group(1) if match else self._key_fallback(json.loads(raw_message))
+        return zlib.crc32(key.encode()) % len(self._rings)
+
+
+    def stats(self) -> Dict:
+        '''
+        Per shard and aggregate counters
+        Rates are averaged since `start()`
+        '''
+        elapsed = max(time.time() - (self._started or time.time()), 1e-9)
+        shards = [
+            dict(
+                shard=shard,
+                routed=self._routed[shard],
+                dropped=self._dropped[shard],
+                processed=self._processed[shard],
+                processed_bytes=self._processed_bytes[shard],
+                backlog_bytes=ring.backlog(),
+                stalls=ring.stalls,
+            )
+            for shard, ring in enumerate(self._rings)
+        ]
+        processed = sum(s['processed'] for s in shards)
+        return dict(
+            elapsed=elapsed,
+            routed=sum(self._routed),
+            dropped=sum(self._dropped),
+            processed=processed,
+            processed_per_second=processed / elapsed,
+            processed_bytes_per_second=sum(s['processed_bytes'] for s in shards) / elapsed,
+            shards=shards,
+        )
+
+
+    def _wanted_here(self, raw_message: str) -> bool:
+        '''
+        Whether a transaction frame is needed in this process as well as on its shard
+        '''
+        # direct subscriptions here feed the shards, so only the consumers' own filters count
+        if self.subscriptions.transaction_consumers and self.subscriptions.consumers_want(FrameKeys(raw_message)):
+            return True
+        if self.submissions.transactions:
+            return any(h in self.submissions.transactions for h in _TX_HASH.findall(raw_message))
+        return False
+
+
+    def _on_message(self, ws, raw_message: str) -> None:
+        if not _IS_TRANSACTION.search(raw_message):
+            super()._on_message(ws, raw_message)
+            return
+
+        if self._wanted_here(raw_message):
+            super()._on_message(ws, raw_message)
+
+        try:
+            shard = self.shard_for(raw_message)
+        except (KeyError, ValueError) as e:
+            logger.warning(f'Unroutable transaction frame: {repr(e)}')
+            return
+
+        if self._dropped[shard]:
+            # the worker is gone, don't wait on its ring again
+            self._dropped[shard] += 1
+            return
+
+        worker = self._workers[shard] if self._workers else None
+        try:
+            self._rings[shard].put(raw_message.encode(), consumer=worker)
+        except BrokenPipeError as e:
+            logger.error(f'Shard {shard} worker died, dropping its frames: {repr(e)}')
+            self._dropped[shard] += 1
+            return
+        self._routed[shard] += 1
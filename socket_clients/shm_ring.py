@@ -0,0 +1,133 @@
+import time
+import struct
+import multiprocessing
+
+
+class ShmRing:
+    '''
+    Single producer / single consumer ring buffer of byte records in shared memory
+
+    Built on `multiprocessing.RawArray` so it works with both fork and spawn
+    and needs nothing newer than python 3.7. Hand it to the consumer process
+    as a `Process` argument.
+
+    Layout:
+        [write_pos][read_pos][closed]  each on its own cache line
+        [data ...]                     records of <u32 length><payload>
+
+    Positions only ever grow; the offset into the data area is `pos % capacity`.
+    A record never wraps: if it doesn't fit in the tail, the producer leaves a
+    WRAP marker (or a tail too short for a length) and starts again at 0.
+
+    The items semaphore counts published records. Releasing/acquiring it is
+    what makes the payload bytes visible to the other process before it reads them.
+    '''
+    _SLOT = 64
+    _WRITE = 0
+    _READ = _SLOT
+    _CLOSED = 2 * _SLOT
+    _DATA = 3 * _SLOT
+    _LEN = struct.Struct('<I')
+    _POS = struct.Struct('<Q')
+    _WRAP = 0xFFFFFFFF
+
+    def __init__(self, capacity=8 * 1024 * 1024):
+        self.capacity = capacity
+        self._buf = multiprocessing.RawArray('B', self._DATA + capacity)
+        self._items = multiprocessing.Semaphore(0)
+        # producer side only
+        self.stalls = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_view', None)
+        return state
+
+    @property
+    def view(self):
+        # memoryviews don't pickle, so each process makes its own
+        if '_view' not in self.__dict__:
+            self._view = memoryview(self._buf).cast('B')
+        return self._view
+
+    def _get_pos(self, slot):
+        return self._POS.unpack_from(self.view, slot)[0]
+
+    def _set_pos(self, slot, value):
+        self._POS.pack_into(self.view, slot, value)
+
+    @property
+    def closed(self):
+        return bool(self._get_pos(self._CLOSED))
+
+    def backlog(self):
+        '''
+        Bytes written but not consumed yet
+        '''
+        return self._get_pos(self._WRITE) - self._get_pos(self._READ)
+
+    def put(self, payload: bytes, consumer: multiprocessing.Process = None) -> None:
+        '''
+        Producer: copies `payload` into the ring, waiting while the consumer catches up
+        Raises BrokenPipeError instead of waiting forever if `consumer` has exited
+        '''
+        size = self._LEN.size + len(payload)
+        if size > self.capacity // 2:
+            raise ValueError(f'Record of {len(payload)} bytes is too large for a {self.capacity} byte ring')
+
+        write = self._get_pos(self._WRITE)
+        offset = write % self.capacity
+        tail = self.capacity - offset
+        skip = tail if tail < size else 0
+
+        waits = 0
+        while self.capacity - (write - self._get_pos(self._READ)) < skip + size:
+            # is_alive() is a syscall, only check every ~50ms of waiting
+            if consumer is not None and waits % 100 == 0 and not consumer.is_alive():
+                raise BrokenPipeError(f'{consumer.name} exited, exit code {consumer.exitcode}')
+            waits += 1
+            self.stalls += 1
+            time.sleep(0.0005)
+
+        if skip:
+            if tail >= self._LEN.size:
+                self._LEN.pack_into(self.view, self._DATA + offset, self._WRAP)
+            write += skip
+            offset = 0
+
+        start = self._DATA + offset
+        self._LEN.pack_into(self.view, start, len(payload))
+        self.view[start + self._LEN.size:start + size] = payload
+        self._set_pos(self._WRITE, write + size)
+        self._items.release()
+
+    def get(self, timeout=None):
+        '''
+        Consumer: next record as bytes, or None on timeout / once closed and drained
+        '''
+        if not self._items.acquire(timeout=timeout):
+            return None
+
+        read = self._get_pos(self._READ)
+        if read == self._get_pos(self._WRITE):
+            # woken up by close()
+            return None
+
+        offset = read % self.capacity
+        tail = self.capacity - offset
+        if tail < self._LEN.size or self._LEN.unpack_from(self.view, self._DATA + offset)[0] == self._WRAP:
+            read += tail
+            offset = 0
+
+        start = self._DATA + offset
+        length = self._LEN.unpack_from(self.view, start)[0]
+        payload = bytes(self.view[start + self._LEN.size:start + self._LEN.size + length])
+        self._set_pos(self._READ, read + self._LEN.size + length)
+        return payload
+
+    def close(self) -> None:
+        '''
+        Producer: no more records. The consumer drains what is left, then `get` returns None
+        '''
+        self._set_pos(self._CLOSED, 1)
+        self._items.release()
@@ -0,0 +1,381 @@
+import time
+import struct
+import hashlib
+from threading import Lock
+from typing import Dict, List, Optional
+
+from logger import logger
+
+
+# https://xrpl.org/transaction-results.html
+_FINAL_PREFIXES = ('tem', 'tef', 'tel')
+# Not applied yet but worth sending again on the next ledger close
+_RETRY_RESULTS = ('telCAN_NOT_QUEUE', 'telCAN_NOT_QUEUE_BALANCE', 'telCAN_NOT_QUEUE_BLOCKS',
+                  'telCAN_NOT_QUEUE_BLOCKED', 'telCAN_NOT_QUEUE_FEE', 'telCAN_NOT_QUEUE_FULL',
+                  'telINSUF_FEE_P')
+# https://xrpl.org/error-formatting.html#universal-errors, the server is busy or catching up,
+# the blob was never looked at so it is sent again on the next ledger close
+_RETRY_ERRORS = ('slowDown', 'tooBusy', 'noNetwork', 'noCurrent', 'noClosed')
+
+_TXN_PREFIX = b'TXN\x00'
+_SEQUENCE = 4
+_LAST_LEDGER_SEQUENCE = 27
+_TICKET_SEQUENCE = 41
+_ACCOUNT = 1
+
+# https://xrpl.org/serialization.html#type-list, fixed sizes of the types before AccountID
+_FIXED_SIZES = {1: 2, 2: 4, 3: 8, 4: 16, 5: 32}
+_AMOUNT, _BLOB, _ACCOUNT_ID = 6, 7, 8
+_ADDRESS_ALPHABET = 'rpshnaf39wBUDNEGHJKLM4PQRST7VWXYZ2bcdeCg65jkm8oFqi1tuvAxyz'
+
+
+def transaction_hash(tx_blob: str) -> str:
+    '''
+    Hash of a signed transaction, the same one the server reports
+    SHA-512Half of the `TXN\\0` prefix + the serialized transaction
+    '''
+    return hashlib.sha512(_TXN_PREFIX + bytes.fromhex(tx_blob)).digest()[:32].hex().upper()
+
+
+def encode_address(account_id: bytes) -> str:
+    '''
+    Classic r-address of a 20 byte AccountID (base58check, type prefix 0)
+    '''
+    payload = b'\x00' + account_id
+    payload += hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    n = int.from_bytes(payload, 'big')
+    address = ''
+    while n:
+        n, r = divmod(n, 58)
+        address = _ADDRESS_ALPHABET[r] + address
+    leading = len(payload) - len(payload.lstrip(b'\x00'))
+    return _ADDRESS_ALPHABET[0] * leading + address
+
+
+def _vl_length(data: bytes, i: int):
+    '''
+    Variable length prefix at `i` -> (length, index after the prefix)
+    '''
+    b0 = data[i]
+    if b0 <= 192:
+        return b0, i + 1
+    if b0 <= 240:
+        return 193 + (b0 - 193) * 256 + data[i + 1], i + 2
+    return 12481 + (b0 - 241) * 65536 + data[i + 1] * 256 + data[i + 2], i + 3
+
+
+def blob_fields(tx_blob: str) -> Dict:
+    '''
+    Reads Sequence, TicketSequence, LastLedgerSequence and Account straight out of a signed blob
+
+    Serialized fields are sorted by type code, and everything we need sits in
+    the types up to AccountID (8). We walk those, skipping the ones we don't
+    need by their size, and stop at the first field of a later type, no binary
+    codec needed.
+    '''
+    data = bytes.fromhex(tx_blob)
+    fields = dict()
+    i = 0
+    while i < len(data):
+        type_code, field_code = data[i] >> 4, data[i] & 0x0F
+        i += 1
+        if type_code == 0:
+            type_code = data[i]
+            i += 1
+        if field_code == 0:
+            field_code = data[i]
+            i += 1
+
+        if type_code == 2:
+            value = struct.unpack_from('>I', data, i)[0]
+            if field_code == _SEQUENCE:
+                fields['Sequence'] = value
+            elif field_code == _LAST_LEDGER_SEQUENCE:
+                fields['LastLedgerSequence'] = value
+            elif field_code == _TICKET_SEQUENCE:
+                fields['TicketSequence'] = value
+            i += 4
+        elif type_code in _FIXED_SIZES:
+            i += _FIXED_SIZES[type_code]
+        elif type_code == _AMOUNT:
+            # XRP is 8 bytes, issued currencies 48, MPTs 33
+            i += 48 if data[i] & 0x80 else 33 if data[i] & 0x20 else 8
+        elif type_code in (_BLOB, _ACCOUNT_ID):
+            length, i = _vl_length(data, i)
+            if type_code == _ACCOUNT_ID and field_code == _ACCOUNT:
+                fields['Account'] = encode_address(data[i:i + length])
+            i += length
+        else:
+            break
+    return fields
+
+
+class SubmittedTransaction:
+    '''
+    A signed blob on its way through the network
+
+    status:
+        queued      waiting to be (re)sent
+        submitted   sent, waiting for the submit response
+        pending     accepted by the server, waiting for a validated ledger
+        validated   in a validated ledger (`engine_result` tells you if it succeeded)
+        rejected    the server won't apply it (tem/tef/tel results, or an error reply such as
+                    invalidTransaction, kept in `error`)
+        expired     LastLedgerSequence passed without it being validated
+    '''
+    FINAL = ('validated', 'rejected', 'expired')
+
+    def __init__(self, tx_blob: str) -> None:
+        self.tx_blob = tx_blob
+        self.hash = transaction_hash(tx_blob)
+        fields = blob_fields(tx_blob)
+        self.sequence = fields.get('Sequence') or fields.get('TicketSequence')
+        self.last_ledger_sequence = fields.get('LastLedgerSequence')
+        self.account = fields.get('Account')
+        self.status = 'queued'
+        self.engine_result = None
+        self.error = None
+        self.ledger_index = None
+        self.attempts = 0
+        self.submitted_time = None
+        self.first_submitted_time = None
+        self.final_time = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in self.FINAL
+
+    @property
+    def latency(self) -> Optional[float]:
+        '''
+        Seconds from the first submit to validated (or rejected / expired)
+        '''
+        if self.final_time is None or self.first_submitted_time is None:
+            return None
+        return self.final_time - self.first_submitted_time
+
+    def __repr__(self) -> str:
+        return f'<SubmittedTransaction {self.hash} {self.status} {self.engine_result}>'
+
+
+class SubmissionTracker:
+    '''
+    Docs:
+        https://xrpl.org/submit.html
+        https://xrpl.org/reliable-transaction-submission.html
+
+    Description:
+        Follows pre-signed transactions from `submit` until they are validated,
+        rejected or expired
+
+        - Submits are pipelined: blobs go out back to back without waiting on responses,
+            in Sequence order so the server can queue each account's transactions
+        - Each submitting account (read from the blob) gets an `accounts` subscription
+            before its first submit goes out, and the `ledger` stream is subscribed once,
+            so results come from the streams rather than polling
+        - Results the server may still accept later (a full transaction queue) and
+            temporary error replies (slowDown, tooBusy, ...) are held and sent again,
+            in Sequence order, on the next ledger close
+        - Anything not validated by its LastLedgerSequence is marked expired
+
+    Example:
+        >>> txs = xrpl.submit_multiple(signed_blobs)
+        >>> [(tx.hash, tx.status, tx.latency) for tx in txs]
+        >>> xrpl.submissions.stats()
+    '''
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.lock = Lock()
+        self.transactions: Dict[str, SubmittedTransaction] = dict()
+        self._held: List[SubmittedTransaction] = list()
+        self._accounts = set()
+        self._ledger_subscribed = False
+        self.validated_ledger_index = None
+
+
+    def submit(self, tx_blobs: List[str]) -> List[SubmittedTransaction]:
+        '''
+        Tracks and sends signed blobs
+        A blob that is already in flight is sent again and its existing SubmittedTransaction returned
+        '''
+        candidates = [SubmittedTransaction(blob) for blob in tx_blobs]
+        txs = list()
+        sub = dict()
+        with self.lock:
+            for tx in candidates:
+                tracked = self.transactions.get(tx.hash)
+                if tracked is not None and not tracked.done:
+                    tx = tracked
+                else:
+                    self.transactions[tx.hash] = tx
+                if tx not in txs:
+                    txs.append(tx)
+            if not self._ledger_subscribed:
+                self._ledger_subscribed = True
+                sub['streams'] = ['ledger']
+            accounts = {tx.account for tx in txs if tx.account} - self._accounts
+            if accounts:
+                self._accounts |= accounts
+                sub['accounts'] = sorted(accounts)
+
+        # subscribed before the submits go out, so no validated message can slip past
+        if sub:
+            self.client.subscribe(sub, internal=True)
+
+        # sorted() is stable, so each account's own transactions stay in Sequence order
+        for tx in sorted(txs, key=lambda tx: tx.sequence or 0):
+            self._send(tx)
+        return txs
+
+
+    def _send(self, tx: SubmittedTransaction) -> None:
+        tx.status = 'submitted'
+        tx.attempts += 1
+        tx.submitted_time = time.time()
+        if tx.first_submitted_time is None:
+            tx.first_submitted_time = tx.submitted_time
+        self.client.submit_blob(
+            tx.tx_blob,
+            handler=self._response_handler(tx),
+            error_handler=self._error_handler(tx),
+        )
+
+
+    def _response_handler(self, tx: SubmittedTransaction):
+        def handler(message):
+            self.on_submit_response(tx, message)
+        return handler
+
+
+    def _error_handler(self, tx: SubmittedTransaction):
+        def handler(message):
+            self.on_submit_error(tx, message)
+        return handler
+
+
+    def on_submit_response(self, tx: SubmittedTransaction, message: Dict) -> None:
+        result = message.get('result', dict())
+        tx_json = result.get('tx_json', dict())
+        engine_result = result.get('engine_result', '')
+
+        with self.lock:
+            if tx.done:
+                return
+            tx.engine_result = engine_result
+            tx.error = None
+            tx.account = tx_json.get('Account', tx.account)
+            if tx.last_ledger_sequence is None:
+                tx.last_ledger_sequence = tx_json.get('LastLedgerSequence')
+
+            if engine_result in _RETRY_RESULTS:
+                tx.status = 'queued'
+                self._hold(tx)
+            elif engine_result.startswith(_FINAL_PREFIXES):
+                self._finish(tx, 'rejected')
+            else:
+                tx.status = 'pending'
+
+            subscribe = tx.account and tx.account not in self._accounts
+            if subscribe:
+                self._accounts.add(tx.account)
+
+        if subscribe:
+            self.client.subscribe(dict(accounts=[tx.account]), internal=True)
+
+
+    def on_submit_error(self, tx: SubmittedTransaction, message: Dict) -> None:
+        '''
+        Error reply to a submit (invalidTransaction, highFee, slowDown, ...), the blob was never applied
+        '''
+        with self.lock:
+            if tx.done:
+                return
+            tx.error = message.get('error')
+            if tx.error in _RETRY_ERRORS:
+                tx.status = 'queued'
+                self._hold(tx)
+            else:
+                self._finish(tx, 'rejected')
+
+
+    def on_transaction(self, message: Dict) -> None:
+        '''
+        Transaction stream message, from an `accounts` subscription
+        '''
+        if not message.get('validated'):
+            return
+        _hash = message.get('transaction', dict()).get('hash')
+        with self.lock:
+            tx = self.transactions.get(_hash)
+            if tx is None or tx.done:
+                return
+            tx.engine_result = message.get('engine_result', tx.engine_result)
+            tx.ledger_index = message.get('ledger_index')
+            self._finish(tx, 'validated')
+
+
+    def on_ledger_closed(self, message: Dict) -> None:
+        '''
+        ledgerClosed stream message: expire what can no longer make it, resend what was held
+        '''
+        ledger_index = message.get('ledger_index')
+        if ledger_index is None:
+            return
+        with self.lock:
+            self.validated_ledger_index = ledger_index
+            for tx in self.transactions.values():
+                if not tx.done and tx.last_ledger_sequence and tx.last_ledger_sequence < ledger_index:
+                    self._finish(tx, 'expired')
+            held = sorted((tx for tx in self._held if not tx.done), key=lambda tx: tx.sequence or 0)
+            self._held = list()
+
+        for tx in held:
+            self._send(tx)
+
+
+    def _hold(self, tx: SubmittedTransaction) -> None:
+        if tx not in self._held:
+            self._held.append(tx)
+
+
+    def _finish(self, tx: SubmittedTransaction, status: str) -> None:
+        tx.status = status
+        tx.final_time = time.time()
+        logger.info(f'Transaction {tx.hash} {status}: {tx.engine_result or tx.error} after {tx.latency}s')
+
+
+    def in_flight(self, account: Optional[str] = None) -> int:
+        with self.lock:
+            return sum(
+                1 for tx in self.transactions.values()
+                if not tx.done and (account is None or tx.account == account)
+            )
+
+
+    def forget_done(self) -> List[SubmittedTransaction]:
+        '''
+        Drops finished transactions from tracking and returns them
+        '''
+        with self.lock:
+            done = [tx for tx in self.transactions.values() if tx.done]
+            for tx in done:
+                del self.transactions[tx.hash]
+        return done
+
+
+    def stats(self) -> Dict:
+        with self.lock:
+            txs = list(self.transactions.values())
+        latencies = sorted(tx.latency for tx in txs if tx.status == 'validated')
+        stats = dict(in_flight=sum(1 for tx in txs if not tx.done))
+        for status in SubmittedTransaction.FINAL:
+            stats[status] = sum(1 for tx in txs if tx.status == status)
+        if latencies:
+            stats.update(
+                latency_min=latencies[0],
+                latency_p50=latencies[len(latencies) // 2],
+                latency_p99=latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+                latency_max=latencies[-1],
+            )
+        return stats
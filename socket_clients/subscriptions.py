@@ -0,0 +1,534 @@
+import re
+import json
+from threading import Lock
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+
+# Stream name -> `type` of the messages it sends
+STREAM_MESSAGE_TYPES = {
+    'ledger': 'ledgerClosed',
+    'server': 'serverStatus',
+    'book_changes': 'bookChanges',
+    'validations': 'validationReceived',
+    'manifests': 'manifestReceived',
+    'peer_status': 'peerStatusChange',
+    'consensus': 'consensusPhase',
+    'transactions': 'transaction',
+    'transactions_proposed': 'transaction',
+}
+MESSAGE_TYPES = frozenset(STREAM_MESSAGE_TYPES.values())
+
+# https://xrpl.org/transaction-types.html, each type gets one bit
+TRANSACTION_TYPES = (
+    'Payment', 'OfferCreate', 'OfferCancel', 'TrustSet', 'AccountSet', 'AccountDelete',
+    'SetRegularKey', 'SignerListSet', 'EscrowCreate', 'EscrowFinish', 'EscrowCancel',
+    'PaymentChannelCreate', 'PaymentChannelFund', 'PaymentChannelClaim',
+    'CheckCreate', 'CheckCash', 'CheckCancel', 'DepositPreauth', 'TicketCreate',
+    'NFTokenMint', 'NFTokenBurn', 'NFTokenCreateOffer', 'NFTokenCancelOffer', 'NFTokenAcceptOffer',
+    'NFTokenModify', 'Clawback', 'AMMClawback',
+    'AMMCreate', 'AMMDeposit', 'AMMWithdraw', 'AMMVote', 'AMMBid', 'AMMDelete',
+    'DIDSet', 'DIDDelete', 'OracleSet', 'OracleDelete',
+    'MPTokenIssuanceCreate', 'MPTokenIssuanceDestroy', 'MPTokenIssuanceSet', 'MPTokenAuthorize',
+    'CredentialCreate', 'CredentialAccept', 'CredentialDelete',
+    'XChainCreateBridge', 'XChainModifyBridge', 'XChainCreateClaimID', 'XChainCommit', 'XChainClaim',
+    'XChainAccountCreateCommit', 'XChainAddClaimAttestation', 'XChainAddAccountCreateAttestation',
+    'PermissionedDomainSet', 'PermissionedDomainDelete', 'DelegateSet', 'Batch', 'LedgerStateFix',
+    'VaultCreate', 'VaultSet', 'VaultDelete', 'VaultDeposit', 'VaultWithdraw', 'VaultClawback',
+    'EnableAmendment', 'SetFee', 'UNLModify',
+)
+_TYPE_BITS = {name: 1 << i for i, name in enumerate(TRANSACTION_TYPES)}
+# types newer than the table above share this bit, it only narrows things down,
+# the exact name is compared after it matches
+_OTHER_TYPE = 1 << len(TRANSACTION_TYPES)
+
+IS_TRANSACTION = re.compile(r'"type"\s*:\s*"transaction"')
+_TX_TYPE = re.compile(r'"TransactionType"\s*:\s*"(\w+)"')
+_ADDRESS = re.compile(r'"(r[1-9A-HJ-NP-Za-km-z]{24,34})"')
+_VALIDATED = re.compile(r'"validated"\s*:\s*true')
+
+
+def type_mask(transaction_types: Optional[Iterable[str]]) -> Optional[int]:
+    '''
+    Bitmask for a set of TransactionType names, None means any type
+    '''
+    if transaction_types is None:
+        return None
+    mask = 0
+    for name in transaction_types:
+        mask |= _TYPE_BITS.get(name, _OTHER_TYPE)
+    return mask
+
+
+class FrameKeys:
+    '''
+    What the filters need from a raw transaction frame, pulled out without a json decode
+    Accounts are every address in the frame, metadata included, and only extracted if a filter asks
+    '''
+    __slots__ = ('raw', 'transaction_type', 'type_bit', 'validated', '_accounts')
+
+    def __init__(self, raw: str) -> None:
+        self.raw = raw
+        match = _TX_TYPE.search(raw)
+        self.transaction_type = match.group(1) if match else None
+        self.type_bit = _TYPE_BITS.get(self.transaction_type, _OTHER_TYPE)
+        self.validated = _VALIDATED.search(raw) is not None
+        self._accounts = None
+
+    @property
+    def accounts(self) -> FrozenSet[str]:
+        if self._accounts is None:
+            self._accounts = frozenset(_ADDRESS.findall(self.raw))
+        return self._accounts
+
+
+def book_key(taker_gets: Dict, taker_pays: Dict, taker=None) -> str:
+    return json.dumps([taker_gets, taker_pays, taker], sort_keys=True)
+
+
+class Subscription:
+    '''
+    Base for the typed subscription builders
+
+    The constructor arguments of each builder are the server side options
+    rippled offers. On top of those every builder takes client side filters
+    for what the server can't narrow, compiled once up front:
+        transaction_types   only these TransactionTypes (a bitmask test)
+        accounts            only transactions mentioning one of these addresses (a set test)
+        validated_only      drop proposed / unvalidated transactions
+
+    Only the `*_proposed` subscriptions ever pass unvalidated transactions on.
+    Everything else is validated_only regardless, since proposed frames for
+    another consumer (or a merged `*_proposed` server subscription) share the socket.
+    '''
+    streams: tuple = ()
+
+    def __init__(self, transaction_types=None, accounts=None, validated_only=False) -> None:
+        self.type_mask = type_mask(transaction_types)
+        # names outside TRANSACTION_TYPES, which all share the _OTHER_TYPE bit
+        self.other_types = None if transaction_types is None else frozenset(
+            name for name in transaction_types if name not in _TYPE_BITS
+        )
+        self.filter_accounts = frozenset(accounts) if accounts is not None else None
+        self.validated_only = validated_only or not self._proposed()
+        self.message_types = frozenset(STREAM_MESSAGE_TYPES[s] for s in self.streams)
+        self.handler: Optional[Callable] = None
+
+    def _proposed(self) -> bool:
+        return False
+
+    def _match_frame(self, keys: FrameKeys) -> bool:
+        return True
+
+    def matches(self, message_type: str, keys: Optional[FrameKeys]) -> bool:
+        if message_type not in self.message_types:
+            return False
+        if keys is None:
+            return True
+        if self.type_mask is not None and not self.type_mask & keys.type_bit:
+            return False
+        if keys.type_bit == _OTHER_TYPE and self.other_types is not None and keys.transaction_type not in self.other_types:
+            return False
+        if self.validated_only and not keys.validated:
+            return False
+        if self.filter_accounts is not None and self.filter_accounts.isdisjoint(keys.accounts):
+            return False
+        return self._match_frame(keys)
+
+
+class StreamSubscription(Subscription):
+    '''
+    https://xrpl.org/subscribe.html#streams
+
+    >>> StreamSubscription('ledger', 'server')
+    >>> StreamSubscription('transactions', transaction_types=['OfferCreate', 'OfferCancel'])
+    '''
+
+    def __init__(self, *streams: str, **filters) -> None:
+        unknown = set(streams) - set(STREAM_MESSAGE_TYPES)
+        if unknown:
+            raise KeyError(f'Unknown streams: {sorted(unknown)}')
+        self.streams = tuple(streams)
+        super().__init__(**filters)
+
+    def _proposed(self) -> bool:
+        return 'transactions_proposed' in self.streams
+
+
+class AccountSubscription(Subscription):
+    '''
+    https://xrpl.org/subscribe.html#transaction-streams
+
+    Transactions affecting any of `accounts`
+    proposed=True uses `accounts_proposed`, which also sends unvalidated transactions
+
+    >>> AccountSubscription(['rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3'], transaction_types=['Payment'])
+    '''
+    streams = ('transactions',)
+
+    def __init__(self, accounts: Iterable[str], proposed=False, **filters) -> None:
+        self.accounts = frozenset(accounts)
+        self.proposed = proposed
+        super().__init__(**filters)
+
+    def _proposed(self) -> bool:
+        return self.proposed
+
+    def _match_frame(self, keys: FrameKeys) -> bool:
+        # other consumers' subscriptions arrive on the same socket
+        return not self.accounts.isdisjoint(keys.accounts)
+
+
+class BookSubscription(Subscription):
+    '''
+    https://xrpl.org/subscribe.html#order-book-streams
+
+    Transactions that affect the order book
+        taker       view the book as this account (its own offers look unfunded)
+        snapshot    the subscribe response carries the current offers, passed to `handler`
+        both        also the reverse book
+
+    Which transactions arrive for which book is only known to the server, so on
+    the client a book consumer gets transactions mentioning one of the book's issuers.
+
+    >>> BookSubscription({'currency': 'XRP'}, {'currency': 'USD', 'issuer': 'rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B'}, snapshot=True, both=True)
+    '''
+    streams = ('transactions',)
+
+    def __init__(self, taker_gets: Dict, taker_pays: Dict, taker=None, snapshot=False, both=False, **filters) -> None:
+        super().__init__(**filters)
+        self.taker_gets = taker_gets
+        self.taker_pays = taker_pays
+        self.taker = taker
+        self.snapshot = snapshot
+        self.both = both
+        self.issuers = frozenset(side['issuer'] for side in (taker_gets, taker_pays) if 'issuer' in side)
+
+    def key(self, reverse=False) -> str:
+        if reverse:
+            return book_key(self.taker_pays, self.taker_gets, self.taker)
+        return book_key(self.taker_gets, self.taker_pays, self.taker)
+
+    def book(self) -> Dict:
+        book = dict(taker_gets=self.taker_gets, taker_pays=self.taker_pays)
+        if self.taker:
+            book['taker'] = self.taker
+        if self.both:
+            book['both'] = True
+        return book
+
+    def _match_frame(self, keys: FrameKeys) -> bool:
+        return not self.issuers or not self.issuers.isdisjoint(keys.accounts)
+
+
+def _directions(books: Dict[str, Dict]) -> Dict[str, Dict]:
+    '''
+    Every one-way book the server sends for, `both` books count twice
+    '''
+    directions = dict()
+    for key, book in books.items():
+        one_way = {k: v for k, v in book.items() if k != 'both'}
+        directions[key] = one_way
+        if book.get('both'):
+            reverse = dict(one_way, taker_gets=book['taker_pays'], taker_pays=book['taker_gets'])
+            directions[book_key(reverse['taker_gets'], reverse['taker_pays'], book.get('taker'))] = reverse
+    return directions
+
+
+def _carries_transactions(key: Tuple) -> bool:
+    return key[0] != 'streams' or key[1] in ('transactions', 'transactions_proposed')
+
+
+class SubscriptionManager:
+    '''
+    Docs:
+        https://xrpl.org/subscribe.html
+        https://xrpl.org/unsubscribe.html
+
+    Description:
+        Lets many consumers subscribe independently while the server only sees
+        the smallest set of subscriptions that covers all of them:
+            - the same stream / account / book from several consumers is subscribed once
+            - accounts also in `accounts_proposed`, and `transactions` when
+                `transactions_proposed` is on, are already covered and dropped
+            - a book and its reverse become one book with `both`
+        Adding or removing a consumer sends only the difference.
+
+        Every stream, account and book direction on the server is refcounted,
+        across consumers and every `subscribe` / `unsubscribe` call on the client
+        (`xrpl.ledgers`, `xrpl.submissions` and your own). The server is only told
+        to unsubscribe when the last holder lets go.
+
+        Transaction frames are checked against the union of every consumer's
+        compiled filters before they are decoded; frames nobody wants are
+        dropped right there. Matching frames are decoded once and handed to
+        each consumer whose own filter matches. While you hold transaction
+        carrying subscriptions of your own (`direct_transactions`), nothing is dropped.
+
+    Example:
+        >>> offers = xrpl.subscriptions.add(
+                StreamSubscription('transactions', transaction_types=['OfferCreate', 'OfferCancel']),
+                handler=on_offer,
+            )
+        >>> xrpl.subscriptions.remove(offers)
+    '''
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.lock = Lock()
+        self.consumers: List[Subscription] = list()
+        self._server = self._empty()
+        # refcounts, and the part of them held by direct `subscribe` calls
+        self._refs_lock = Lock()
+        self._refs: Dict[Tuple, int] = dict()
+        self._direct: Dict[Tuple, int] = dict()
+        self._values: Dict[Tuple, Any] = dict()
+        self.direct_transactions = 0
+        self._union_mask: Optional[int] = None
+        self._union_other_types: Optional[FrozenSet[str]] = None
+        self._union_accounts: Optional[FrozenSet[str]] = None
+        self._union_validated_only = False
+        self.transaction_consumers = 0
+
+
+    def add(self, subscription: Subscription, handler: Callable[[Dict], None]) -> Subscription:
+        '''
+        Starts delivering matching messages to `handler`
+        A BookSubscription with snapshot=True also gets the subscribe response (the current offers)
+        '''
+        subscription.handler = handler
+        with self.lock:
+            self.consumers.append(subscription)
+            snapshot = subscription if isinstance(subscription, BookSubscription) and subscription.snapshot else None
+            self._sync(snapshot)
+        return subscription
+
+
+    def remove(self, subscription: Subscription) -> None:
+        with self.lock:
+            if subscription in self.consumers:
+                self.consumers.remove(subscription)
+                self._sync()
+
+
+    @staticmethod
+    def _empty() -> Dict:
+        return dict(streams=set(), accounts=set(), accounts_proposed=set(), books=dict())
+
+
+    @staticmethod
+    def keys(sub: Dict) -> Dict[Tuple, Any]:
+        '''
+        Refcount keys of a subscribe request (or a `server_set`) -> what unsubscribing each one takes
+        Books count once per direction
+        '''
+        keys = dict()
+        for kind in ('streams', 'accounts', 'accounts_proposed'):
+            for name in sub.get(kind, ()):
+                keys[(kind, name)] = name
+        books = sub.get('books', ())
+        if isinstance(books, dict):
+            books = books.values()
+        books = {book_key(b['taker_gets'], b['taker_pays'], b.get('taker')): b for b in books}
+        for key, book in _directions(books).items():
+            keys[('books', key)] = dict(taker_gets=book['taker_gets'], taker_pays=book['taker_pays'])
+        return keys
+
+
+    @staticmethod
+    def _group(keys: Dict[Tuple, Any]) -> Dict:
+        grouped = dict()
+        for (kind, _), value in keys.items():
+            grouped.setdefault(kind, list()).append(value)
+        return grouped
+
+
+    def retain(self, keys: Dict[Tuple, Any], direct=False) -> Dict[Tuple, Any]:
+        '''
+        Takes a reference on each key, returns the ones that weren't on the server yet
+        '''
+        new = dict()
+        with self._refs_lock:
+            for key, value in keys.items():
+                count = self._refs.get(key, 0)
+                if not count:
+                    new[key] = self._values[key] = value
+                self._refs[key] = count + 1
+                if direct:
+                    self._direct[key] = self._direct.get(key, 0) + 1
+                    if _carries_transactions(key):
+                        self.direct_transactions += 1
+        return new
+
+
+    def release(self, keys: Dict[Tuple, Any], direct=False, count=1) -> Dict:
+        '''
+        Drops `count` references on each key
+        Returns the unsubscribe request for the ones nobody holds any more (empty if none)
+        A direct release only drops references direct calls took
+        '''
+        gone = dict()
+        with self._refs_lock:
+            for key in keys:
+                if direct:
+                    if not self._direct.get(key):
+                        continue
+                    self._direct[key] -= 1
+                    if _carries_transactions(key):
+                        self.direct_transactions -= 1
+                refs = self._refs.get(key, 0)
+                if refs > count:
+                    self._refs[key] = refs - count
+                elif refs:
+                    del self._refs[key]
+                    gone[key] = self._values.pop(key)
+        return self._group(gone)
+
+
+    def release_all(self) -> Dict:
+        '''
+        Drops every consumer and every reference direct `subscribe` calls took
+        Returns the unsubscribe request for what nothing else holds; the holds of
+        `xrpl.ledgers` and `xrpl.submissions` stay, they still need their streams
+        '''
+        with self.lock:
+            held = self.keys(self._server)
+            self.consumers.clear()
+            self._server = self._empty()
+            self._compile()
+            gone = dict()
+            with self._refs_lock:
+                direct = {key: count for key, count in self._direct.items() if count}
+                self._direct.clear()
+                self.direct_transactions = 0
+            for key, count in direct.items():
+                for kind, values in self.release({key: None}, count=count).items():
+                    gone.setdefault(kind, list()).extend(values)
+            for kind, values in self.release(held).items():
+                gone.setdefault(kind, list()).extend(values)
+        return gone
+
+
+    def server_set(self) -> Dict:
+        '''
+        Smallest server side subscription set covering every consumer
+        books maps book_key -> the book as sent
+        '''
+        wanted = self._empty()
+        for sub in self.consumers:
+            if isinstance(sub, StreamSubscription):
+                wanted['streams'].update(sub.streams)
+            elif isinstance(sub, AccountSubscription):
+                wanted['accounts_proposed' if sub.proposed else 'accounts'].update(sub.accounts)
+            elif isinstance(sub, BookSubscription):
+                reverse = wanted['books'].get(sub.key(reverse=True))
+                if reverse is not None:
+                    reverse['both'] = True
+                    continue
+                book = wanted['books'].setdefault(sub.key(), sub.book())
+                if sub.both:
+                    book['both'] = True
+
+        if 'transactions_proposed' in wanted['streams']:
+            wanted['streams'].discard('transactions')
+        wanted['accounts'] -= wanted['accounts_proposed']
+        return wanted
+
+
+    def _sync(self, snapshot: Optional[BookSubscription] = None) -> None:
+        '''
+        Moves this manager's references from what it held to what the consumers need now.
+        Only keys that no other holder has are sent, new subscriptions first so there is no gap
+        '''
+        wanted = self.server_set()
+        wanted_keys = self.keys(wanted)
+        current_keys = self.keys(self._server)
+        self._server = wanted
+
+        new = self.retain({k: v for k, v in wanted_keys.items() if k not in current_keys})
+        add = self._group({k: v for k, v in new.items() if k[0] != 'books'})
+
+        # books go out whole (with `both`), if any of their directions is new
+        books = dict()
+        for key, book in wanted['books'].items():
+            if any(('books', direction) in new for direction in _directions({key: book})):
+                books[key] = book
+        if snapshot is not None:
+            key = snapshot.key() if snapshot.key() in wanted['books'] else snapshot.key(reverse=True)
+            books[key] = dict(wanted['books'][key], snapshot=True)
+        if books:
+            add['books'] = list(books.values())
+
+        if add:
+            handler = snapshot.handler if snapshot is not None else None
+            self.client._send_subscribe(add, handler=handler)
+        drop = self.release({k: v for k, v in current_keys.items() if k not in wanted_keys})
+        if drop:
+            self.client._send_unsubscribe(drop)
+        self._compile()
+
+
+    def _compile(self) -> None:
+        '''
+        Precomputes the union of every transaction consumer's filters, None meaning anything goes
+        '''
+        tx_consumers = [sub for sub in self.consumers if 'transaction' in sub.message_types]
+        self.transaction_consumers = len(tx_consumers)
+
+        mask = 0
+        for sub in tx_consumers:
+            if sub.type_mask is None:
+                mask = None
+                break
+            mask |= sub.type_mask
+        self._union_mask = mask if tx_consumers else None
+        self._union_other_types = frozenset().union(*(sub.other_types for sub in tx_consumers)) if mask is not None else None
+
+        accounts = set()
+        for sub in tx_consumers:
+            if sub.filter_accounts is not None:
+                accounts |= sub.filter_accounts
+            elif isinstance(sub, AccountSubscription):
+                accounts |= sub.accounts
+            elif isinstance(sub, BookSubscription) and sub.issuers:
+                accounts |= sub.issuers
+            else:
+                accounts = None
+                break
+        self._union_accounts = frozenset(accounts) if tx_consumers and accounts is not None else None
+        self._union_validated_only = bool(tx_consumers) and all(sub.validated_only for sub in tx_consumers)
+
+
+    def prefilter(self, raw_message: str) -> Optional[FrameKeys]:
+        '''
+        Called on raw transaction frames before decoding
+        Returns their keys, or None when no consumer can want them
+        '''
+        keys = FrameKeys(raw_message)
+        if self.direct_transactions:
+            # frames for direct `subscribe` calls must get through
+            return keys
+        return keys if self.consumers_want(keys) else None
+
+
+    def consumers_want(self, keys: FrameKeys) -> bool:
+        '''
+        Whether any transaction consumer can want the frame, by the compiled union of their filters
+        '''
+        if not self.transaction_consumers:
+            return False
+        if self._union_mask is not None and not self._union_mask & keys.type_bit:
+            return False
+        if keys.type_bit == _OTHER_TYPE and self._union_other_types is not None and keys.transaction_type not in self._union_other_types:
+            return False
+        if self._union_validated_only and not keys.validated:
+            return False
+        if self._union_accounts is not None and self._union_accounts.isdisjoint(keys.accounts):
+            return False
+        return True
+
+
+    def dispatch(self, message: Dict, keys: Optional[FrameKeys] = None) -> None:
+        message_type = message.get('type')
+        for sub in list(self.consumers):
+            if sub.matches(message_type, keys):
+                sub.handler(message)
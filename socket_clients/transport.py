@@ -0,0 +1,89 @@
+import zlib
+
+from websocket import ABNF, WebSocketPayloadException, WebSocketProtocolException
+from websocket._abnf import frame_buffer
+
+# RFC 7692: the sender strips this from every compressed message, the receiver puts it back
+_DEFLATE_TAIL = b'\x00\x00\xff\xff'
+_DATA_OPCODES = (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY)
+
+
+class TransportFrameBuffer(frame_buffer):
+    '''
+    Drop-in replacement for websocket-client's frame reader
+
+    websocket-client rejects any frame with RSV1 set, so it cannot take
+    permessage-deflate traffic on its own. This reader:
+        - inflates compressed messages (RSV1 on the first frame) before the
+            library sees them, so continuation and utf-8 handling stay untouched
+        - refuses frames, and inflated messages, larger than `max_frame_size`
+            before their payload is read off the socket
+
+    The server keeps its compression context between messages unless it
+    negotiated `server_no_context_takeover`, so a single inflater lives for the
+    whole connection.
+
+    `recv_frame` mirrors the library's own and uses its private helpers
+    (`needs_header`, `recv_strict`, `lock`), which only exist in this shape
+    from websocket-client 1.9 on. Older versions fail on the first frame, hence
+    the version range in requirements.txt.
+    '''
+
+    def __init__(self, buffer: frame_buffer, inflate=False, max_frame_size=None):
+        super().__init__(buffer.recv, buffer.skip_utf8_validation)
+        self.max_frame_size = max_frame_size
+        self._inflater = zlib.decompressobj(-zlib.MAX_WBITS) if inflate else None
+        self._inflating = False
+        self._inflated_size = 0
+
+    def recv_frame(self) -> ABNF:
+        with self.lock:
+            if self.needs_header():
+                self.recv_header()
+            fin, rsv1, rsv2, rsv3, opcode, has_mask, _ = self.header
+
+            if self.needs_length():
+                self.recv_length()
+            length = self.length
+            if self.max_frame_size and length > self.max_frame_size:
+                raise WebSocketPayloadException(f'Frame of {length} bytes exceeds max_frame_size')
+
+            if self.needs_mask():
+                self.recv_mask()
+            mask_value = self.mask_value
+
+            payload = self.recv_strict(length)
+            if has_mask:
+                payload = ABNF.mask(mask_value, payload)
+
+            self.clear()
+
+            if rsv1 and self._inflater and opcode in _DATA_OPCODES:
+                self._inflating = True
+                self._inflated_size = 0
+                rsv1 = 0
+            elif self._inflating and opcode in _DATA_OPCODES:
+                raise WebSocketProtocolException('New message before compressed message finished')
+
+            if self._inflating and opcode in (ABNF.OPCODE_CONT,) + _DATA_OPCODES:
+                payload = self._inflate(payload, fin)
+
+            frame = ABNF(fin, rsv1, rsv2, rsv3, opcode, has_mask, payload)
+            frame.validate(self.skip_utf8_validation)
+
+        return frame
+
+    def _inflate(self, payload: bytes, fin) -> bytes:
+        if fin:
+            payload += _DEFLATE_TAIL
+            self._inflating = False
+
+        if not self.max_frame_size:
+            return self._inflater.decompress(payload)
+
+        budget = self.max_frame_size - self._inflated_size
+        data = self._inflater.decompress(payload, budget + 1)
+        self._inflated_size += len(data)
+        if self._inflated_size > self.max_frame_size:
+            raise WebSocketPayloadException('Inflated message exceeds max_frame_size')
+        return data
@@ -1,18 +1,46 @@
 import json
 import time
-from threading import Thread, Lock
-from websocket import WebSocketApp
+import socket
+from threading import Thread, Lock, Event
 
 from logger import logger
 
+# websocket-client, and our frame reader built on it, are only imported on first connect
+# so short lived jobs don't pay for them until they actually talk to a node
+
+DEFLATE_EXTENSION = 'permessage-deflate'
+
 
 class WebsocketManager:
     _CONNECT_TIMEOUT_S = 5
 
-    def __init__(self, socket_name):
+    def __init__(
+        self,
+        socket_name,
+        compression=False,
+        tcp_nodelay=True,
+        recv_buffer_size=None,
+        send_buffer_size=None,
+        max_frame_size=None,
+    ):
+        '''
+        Transport options (all optional):
+            compression: offer permessage-deflate during the handshake.
+                Only used if the server agrees to it
+            tcp_nodelay: disable Nagle's algorithm so small requests go out immediately
+            recv_buffer_size / send_buffer_size: SO_RCVBUF / SO_SNDBUF in bytes
+            max_frame_size: largest frame payload (and inflated message) in bytes
+                we accept before dropping the connection
+        '''
         self.connect_lock = Lock()
         self.ws = None
+        self._handshake_done = Event()
         self.socket_name = socket_name
+        self.compression = compression
+        self.tcp_nodelay = tcp_nodelay
+        self.recv_buffer_size = recv_buffer_size
+        self.send_buffer_size = send_buffer_size
+        self.max_frame_size = max_frame_size
 
     def _get_url(self):
         raise NotImplementedError()
@@ -23,6 +51,28 @@ class WebsocketManager:
     def _on_message(self, ws, message):
         raise NotImplementedError()
 
+    def _on_handshake(self, ws):
+        '''
+        Runs right after the handshake, before the first frame is read.
+        Swaps in our frame reader when compression was negotiated or frames are capped
+        '''
+        from socket_clients.transport import TransportFrameBuffer
+
+        headers = ws.sock.getheaders() or dict()
+        deflate = DEFLATE_EXTENSION in headers.get('sec-websocket-extensions', '')
+        if self.compression and not deflate:
+            logger.warning(f'{self.socket_name} server declined {DEFLATE_EXTENSION}')
+
+        if deflate or self.max_frame_size:
+            ws.sock.frame_buffer = TransportFrameBuffer(
+                ws.sock.frame_buffer,
+                inflate=deflate,
+                max_frame_size=self.max_frame_size,
+            )
+        # Let the connecting thread send right away, no need to wait for _on_open
+        self._handshake_done.set()
+        self._on_open(ws)
+
     def _on_close(self, ws):
         self._reconnect(ws)
 
@@ -36,27 +86,48 @@ class WebsocketManager:
     def send_json(self, message):
         self.send(json.dumps(message))
 
+    def _sockopt(self):
+        '''
+        Socket options handed to `run_forever`, applied before the TCP connect
+        '''
+        sockopt = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(bool(self.tcp_nodelay)))]
+        if self.recv_buffer_size:
+            sockopt.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer_size))
+        if self.send_buffer_size:
+            sockopt.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size))
+        return sockopt
+
     def _connect(self):
         assert not self.ws, "ws should be closed before attempting to connect"
-        self.ws = WebSocketApp(
+        from websocket import WebSocketApp
+
+        header = list()
+        if self.compression:
+            header.append(f'Sec-WebSocket-Extensions: {DEFLATE_EXTENSION}')
+
+        self._handshake_done = handshake_done = Event()
+        self.ws = ws = WebSocketApp(
             self._get_url(),
-            on_open=self._wrap_callback(self._on_open),
+            header=header,
+            on_open=self._wrap_callback(self._on_handshake),
             on_message=self._wrap_callback(self._on_message),
             on_close=self._wrap_callback(self._on_close),
             on_error=self._wrap_callback(self._on_error),
         )
 
-        wst = Thread(name=f'{self.socket_name}', target=self._run_websocket, args=(self.ws,))
+        wst = Thread(name=f'{self.socket_name}', target=self._run_websocket, args=(ws,))
         wst.daemon = True
         wst.start()
 
-        # Wait for socket to connect
+        # Wait for the handshake, woken up the moment it completes.
+        # The timeout slices only matter when the connection fails
         ts = time.time()
-        while self.ws and (not self.ws.sock or not self.ws.sock.connected):
+        while not handshake_done.wait(0.1):
+            if self.ws is not ws:
+                return
             if time.time() - ts > self._CONNECT_TIMEOUT_S:
                 self.ws = None
                 return
-            time.sleep(0.1)
 
     def _wrap_callback(self, f):
         def wrapped_f(ws, *args, **kwargs):
@@ -70,7 +141,7 @@ class WebsocketManager:
 
     def _run_websocket(self, ws):
         try:
-            ws.run_forever()
+            ws.run_forever(sockopt=self._sockopt())
         except Exception as e:
             raise Exception(f'Unexpected error while running websocket: {e}')
         finally:
@@ -83,15 +154,29 @@ class WebsocketManager:
             ws.close()
             self.connect()
 
-    def connect(self):
+    def connect(self, timeout=None):
+        '''
+        Keeps trying until connected, or raises TimeoutError after `timeout` seconds if given
+        '''
         if self.ws:
             return
+        deadline = None if timeout is None else time.time() + timeout
         with self.connect_lock:
             while not self.ws:
                 self._connect()
                 if self.ws:
                     return
+                if deadline is not None and time.time() > deadline:
+                    raise TimeoutError(f'{self.socket_name} could not connect to {self._get_url()}')
     
     def reconnect(self) -> None:
         if self.ws is not None:
             self._reconnect(self.ws)
+
+    def close(self) -> None:
+        '''
+        Closes the connection for good, the reconnect logic leaves it alone
+        '''
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            ws.close()
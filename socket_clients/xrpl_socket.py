@@ -4,6 +4,11 @@ import random
 from typing import List, Dict
 
 from socket_clients.websocket_manager import WebsocketManager
+from socket_clients.path_find import PathFindSessions, PATH_FIND_UPDATE
+from socket_clients.submission import SubmissionTracker, SubmittedTransaction
+from socket_clients.pending_requests import PendingRequests
+from socket_clients.ledger_tracker import LedgerTracker
+from socket_clients.subscriptions import SubscriptionManager, MESSAGE_TYPES, IS_TRANSACTION
 from commons import utils
 from logger import logger
 
@@ -22,6 +27,8 @@ class XRPLWebsocketClient(WebsocketManager):
 
         - If you make an On-Demand API call the message id and handler gets 
             stored in the `self._response_queue` to be processed from the server response
+            It is a `PendingRequests` table, safe to use from any number of threads,
+            and the entry is added before the message goes out
 
         - By On-Demand I mean messages that don't come from a subscription stream
             but rather ones you make and are expecting a one-time response from the server
@@ -29,19 +36,29 @@ class XRPLWebsocketClient(WebsocketManager):
         - All other messages are more than likely subscription streams messages
             that are handled in the `self._on_message` handler
 
+        - Transport options (compression, socket buffers, TCP_NODELAY, max frame size)
+            are passed straight through to the WebsocketManager
+            >>> XRPLWebsocketClient(compression=True, recv_buffer_size=4 * 1024 * 1024)
+
     '''
     
     __FEED = 'XRPL'
     __FEED_TYPE = 'SOCKET'
     __STREAM_URL = 'wss://s.altnet.rippletest.net:51233'
+    # Kept with a pending request, never sent to the server
+    _LOCAL_FIELDS = ('handler', 'error_handler', 'sent_time')
 
-    def __init__(self, stream_url=__STREAM_URL) -> None:
-        super().__init__(socket_name = 'XRPL_WS')
+    def __init__(self, stream_url=__STREAM_URL, **transport_options) -> None:
+        super().__init__(socket_name = 'XRPL_WS', **transport_options)
         self.stream_url = stream_url
         self.feed = self.__FEED
         self.feed_type = self.__FEED_TYPE
         self._subscriptions: List = list()
-        self._response_queue = dict()
+        self._response_queue = PendingRequests()
+        self.path_finds = PathFindSessions(self)
+        self.submissions = SubmissionTracker(self)
+        self.ledgers = LedgerTracker(self)
+        self.subscriptions = SubscriptionManager(self)
 
 
     def _get_url(self) -> str:
@@ -53,21 +70,15 @@ class XRPLWebsocketClient(WebsocketManager):
 
     
 # Helper Functions---------------------------------------------------------------------------------
-    def stale_response_queue_check(self):
+    def stale_response_queue_check(self, stale_seconds=20):
         '''
         Just in case your messages some how drop or were improperly sent.
         You can define a duration for them to remain in your queue.
 
         This is an optional method and is commented out by default in the `_on_message` handler
         '''
-        stale_seconds = 20
-        now = time.time()
-        stale_list = list()
-        for _id, req in self._response_queue.items():
-            if (now - int(req.get('sent_time'))) > 20:
-                stale_list.append(_id)
-        for _id in stale_list:
-            del self._response_queue[_id]
+        for req in self._response_queue.expire(stale_seconds):
+            logger.warning(f"Dropping stale request: {req.get('command')} {req.get('id')}")
 
 
     def response_queue_add(self, payload):
@@ -77,8 +88,23 @@ class XRPLWebsocketClient(WebsocketManager):
         '''
         if not payload.get('id'):
             payload['id'] = utils.generate_uuid()
-        payload.update(sent_time=time.time())
-        self._response_queue[payload['id']] = payload
+        if self._response_queue.add(payload) is not None:
+            logger.warning(f"Replaced pending request with the same id: {payload['id']}")
+
+
+    def send_request(self, payload):
+        '''
+        Registers an On-Demand message and then sends it
+        Registering first means even a very fast response finds its handler
+
+        payload["handler"] runs on success, the optional payload["error_handler"] on an error response
+        '''
+        self.response_queue_add(payload)
+        try:
+            self.send_json({k: v for k, v in payload.items() if k not in self._LOCAL_FIELDS})
+        except Exception:
+            self._response_queue.pop(payload['id'])
+            raise
 
 
 
@@ -102,34 +128,84 @@ class XRPLWebsocketClient(WebsocketManager):
         - When the server responds to your message, it sends you a message with the same ID you sent it
         - The ID then gets looked up from your `self._response_queue` and its respective handler is run 
         - Subscription messages will come in with a 'type' == 'transaction' or 'ledgerClosed'
+        - Async `path_find` updates are handed to `self.path_finds` undecoded,
+            only the newest one per session ever gets parsed
+        - With `self.subscriptions` consumers, transaction frames none of them want
+            are dropped before decoding
         '''
 
         # self.stale_response_queue_check()
 
-        message = json.loads(raw_message) # Load it up
+        if self.path_finds.sessions and PATH_FIND_UPDATE.search(raw_message):
+            self.path_finds.on_update(raw_message)
+            return
+
+        keys = None
+        if self.subscriptions.consumers and IS_TRANSACTION.search(raw_message):
+            keys = self.subscriptions.prefilter(raw_message)
+            # submit() still needs the frames nobody subscribed to
+            if keys is None and not self.submissions.transactions:
+                return
+
+        try:
+            message = json.loads(raw_message) # Load it up
+        except ValueError:
+            logger.error(f'Malformed message: {raw_message[:200]}')
+            return
+
+        if not isinstance(message, dict):
+            logger.warning(f'Unexpected message: {raw_message[:200]}')
+            return
+
+        if self.subscriptions.consumers and isinstance(message.get('type'), str) and message['type'] in MESSAGE_TYPES:
+            if keys is not None or message['type'] != 'transaction':
+                self.subscriptions.dispatch(message, keys)
 
         if 'error' in message:
             # Handler errors here
             logger.error(f'Error: {message}')
+            # The request is answered either way, don't leave it pending
+            req = self._response_queue.pop(message['id']) if 'id' in message else None
+            if req is not None and req.get('error_handler'):
+                req['error_handler'](message)
             return
 
         if message.get('type') == 'response':
             if 'id' in message:
                 # Found in _response_queue?
-                try:
-                    self.__handle_response(self._response_queue[message['id']]["handler"](message))
-                    del self._response_queue[message['id']]
+                req = self._response_queue.pop(message['id'])
+                if req is not None:
+                    self.__handle_response(req["handler"](message))
                     return
-                except KeyError:
-                    logger.warning(f"ID not found in response queue: {message.get('id')}")
+                logger.warning(f"ID not found in response queue: {message.get('id')}")
         elif message.get('type') == 'transaction':
             # Tranaction stream messages
+            if self.submissions.transactions:
+                self.submissions.on_transaction(message)
             self.__transactions_stream_response(message)
             return
         elif message.get('type') == 'ledgerClosed':
             # Ledger Closed stream messages
+            if self.submissions.transactions:
+                self.submissions.on_ledger_closed(message)
+            self.ledgers.on_ledger_closed(message)
             self.__ledger_stream_response(message)
             return
+        elif message.get('type') == 'serverStatus':
+            # Server stream messages, sent when the load changes
+            self.ledgers.on_server_status(message)
+            return
+        elif message.get('type') == 'bookChanges':
+            # Book Changes stream messages, one per ledger
+            self.ledgers.on_book_changes(message)
+            return
+        elif self.subscriptions.consumers and isinstance(message.get('type'), str) and message['type'] in MESSAGE_TYPES:
+            # Other streams, only subscribed to through `self.subscriptions`
+            return
+        elif message.get('type') == 'path_find':
+            # Updates still in flight after their session closed
+            logger.debug(f"path_find update with no open session: {message.get('id')}")
+            return
 
         logger.warning("No Message Type found")
         return
@@ -153,14 +229,12 @@ class XRPLWebsocketClient(WebsocketManager):
         '''
         payload = dict()
         if not _id:
-            _id = utils.generate_uuid('ping')
+            _id = utils.generate_uuid()
 
         payload.update(id=_id, command='ping')
         
-        self.send_json(payload)
-        
         payload["handler"] = self.__ping_response
-        self._response_queue.update({payload["id"]: payload})
+        self.send_request(payload)
         return
 
     def random(self, _id=None) -> None:
@@ -179,19 +253,17 @@ class XRPLWebsocketClient(WebsocketManager):
         
         payload = dict()
         if not _id:
-            _id = utils.generate_uuid('random')
+            _id = utils.generate_uuid()
 
         payload.update(id=_id, command='random')
         
-        self.send_json(payload)
-        
         payload["handler"] = self.__random_response
-        self._response_queue.update({payload["id"]: payload})
+        self.send_request(payload)
         return
 
 
 
-    def subscribe(self, sub: Dict):
+    def subscribe(self, sub: Dict, handler=None, internal=False):
         '''
         Docs: 
             https://xrpl.org/subscribe.html
@@ -206,8 +278,15 @@ class XRPLWebsocketClient(WebsocketManager):
 
             After subscribing, the client will add it to its local list of subscriptions (self._subscriptions)
             The response handler in this case, `self.__subscription_response`, only handles the confirmation message
+                (pass `handler` to use your own, the confirmation carries the stream's current state)
             All other subscription messages are handled by their `type` field in the response message
 
+            Every stream, account and book is refcounted in `self.subscriptions`, so `self.unsubscribe`
+                only reaches the server once nothing else holds it.
+            internal=True is for components that read their own messages (`self.ledgers`,
+                `self.submissions`); their transaction subscriptions don't switch off the
+                `self.subscriptions` pre-decode filters the way direct ones do
+
             # Subscribe to an account and valid transactions for it
             >>> self.subscribe(
                     { 
@@ -227,48 +306,72 @@ class XRPLWebsocketClient(WebsocketManager):
         '''
 
         try:
-            if not sub.get('id'):
-                _id = utils.generate_uuid()
-            
-            payload = dict(id=_id, command='subscribe')
-            payload.update(sub)
-        
-            self.send_json(payload)
-            payload["handler"] = self.__subscription_response
-            self._response_queue.update({payload["id"]: payload})
-        
-            # Add to Running list of Subscriptions
-            if sub.get('streams'):
-                for s in sub['streams']:
-                    self._subscriptions.append(dict(type='streams', stream=s))
-            if sub.get('books'):
-                for b in sub['books']:
-                    self._subscriptions.append(dict(type='books', stream=b))
-            if sub.get('accounts'):
-                for a in sub['accounts']:
-                    self._subscriptions.append(dict(type='accounts', stream=a))
+            self.subscriptions.retain(self.subscriptions.keys(sub), direct=not internal)
+            self._send_subscribe(sub, handler)
         except Exception as e:
             logger.error(f'{repr(e)}')
 
 
-    def unsubscribe_all(self) -> None:
+    def _send_subscribe(self, sub: Dict, handler=None) -> None:
+        _id = sub.get('id') or utils.generate_uuid()
+
+        payload = dict(id=_id, command='subscribe')
+        payload.update(sub)
+
+        payload["handler"] = handler or self.__subscription_response
+        self.send_request(payload)
+
+        # Add to Running list of Subscriptions
+        for kind in ('streams', 'books', 'accounts', 'accounts_proposed'):
+            for s in sub.get(kind, ()):
+                self._subscriptions.append(dict(type=kind, stream=s))
+
+
+    def unsubscribe(self, sub: Dict, handler=None, internal=False) -> None:
         '''
         https://xrpl.org/unsubscribe.html
-        Unsubscribes to all current subscriptions in your local list
+        Unsubscribes from the streams, books and accounts in `sub`, same format as `self.subscribe`
+
+        Subscriptions are refcounted (see `self.subscriptions`), so this only releases
+        what your own `subscribe` calls took, and the server is only told about the ones
+        nothing else in the client still needs
+
+        >>> self.unsubscribe({'streams' : ['ledger']})
         '''
-        
-        payload = dict(command = 'unsubscribe', id = utils.generate_uuid())
-        for sub in self._subscriptions:
-            payload.update({sub['type'] : [sub['stream']]})
 
-        self.send_json(payload)
-        payload["handler"] = self.__unsubscribe_response
-        self._response_queue.update({payload["id"]: payload})
+        drop = self.subscriptions.release(self.subscriptions.keys(sub), direct=not internal)
+        if drop:
+            self._send_unsubscribe(drop, handler)
+
+
+    def _send_unsubscribe(self, sub: Dict, handler=None) -> None:
+        payload = dict(id=utils.generate_uuid(), command='unsubscribe')
+        payload.update(sub)
+
+        payload["handler"] = handler or self.__unsubscribe_response
+        self.send_request(payload)
+
+        def same_book(a: Dict, b: Dict) -> bool:
+            return a['taker_gets'] == b['taker_gets'] and a['taker_pays'] == b['taker_pays']
 
-        # Remove the subscriptions from your local list
-        for sub in self._subscriptions:
-            while sub in self._subscriptions:
-                self._subscriptions.remove(sub)
+        # Remove them from the Running list of Subscriptions
+        for kind in ('streams', 'accounts', 'accounts_proposed'):
+            for s in sub.get(kind, ()):
+                self._subscriptions = [x for x in self._subscriptions if x != dict(type=kind, stream=s)]
+        for b in sub.get('books', ()):
+            self._subscriptions = [x for x in self._subscriptions if not (x['type'] == 'books' and same_book(x['stream'], b))]
+
+
+    def unsubscribe_all(self) -> None:
+        '''
+        https://xrpl.org/unsubscribe.html
+        Unsubscribes from your own subscriptions and drops every `self.subscriptions` consumer
+        What `self.ledgers` / `self.submissions` subscribed to stays, they keep tracking
+        '''
+
+        drop = self.subscriptions.release_all()
+        if drop:
+            self._send_unsubscribe(drop)
 
 
 
@@ -292,14 +395,12 @@ class XRPLWebsocketClient(WebsocketManager):
             raise KeyError('`account` field required')
         
         if not 'id' in req:
-            _id = utils.generate_uuid('account_info')
+            _id = utils.generate_uuid()
             payload['id'] = _id
         
         payload.update(req)
-        self.send_json(payload)
-
         payload["handler"] = self.__account_info_response
-        self._response_queue.update({payload["id"]: payload})
+        self.send_request(payload)
         return
 
 
@@ -326,10 +427,8 @@ class XRPLWebsocketClient(WebsocketManager):
             payload['id'] = _id
 
         payload.update(req)
-        self.send_json(payload)
-
         payload["handler"] = self.__account_lines_response
-        self._response_queue.update({payload["id"]: payload})
+        self.send_request(payload)
         return
 
 
@@ -380,14 +479,113 @@ class XRPLWebsocketClient(WebsocketManager):
 
         # Construct which pair you want
         if not 'id' in book:
-            _id = utils.generate_uuid(_id)
+            _id = utils.generate_uuid()
             book.update(id=_id)
         
         payload.update(book, command='book_offers')
-        self.send_json(payload)
-
         payload["handler"] = self.__book_offers_response
-        self._response_queue.update({payload["id"]: payload})
+        self.send_request(payload)
+        return
+
+
+
+    def submit(self, tx_blob: str) -> SubmittedTransaction:
+        '''
+        https://xrpl.org/submit.html
+
+        Submits a signed transaction blob and tracks it until it is validated,
+        rejected or its LastLedgerSequence passes. This client does not sign.
+
+        Example:
+            >>> tx = self.submit('1200002280000000240000000361D4838D7EA4C6800000...')
+            >>> tx.hash, tx.status, tx.engine_result, tx.latency
+
+        See `SubmissionTracker` (self.submissions) for how results are followed
+        '''
+        return self.submissions.submit([tx_blob])[0]
+
+
+    def submit_multiple(self, tx_blobs: List[str]) -> List[SubmittedTransaction]:
+        '''
+        Pipelines many signed blobs, in Sequence order, without waiting on each response
+        Returns the tracked transactions in the order given
+
+        >>> txs = self.submit_multiple(signed_blobs)
+        >>> self.submissions.stats()
+        '''
+        return self.submissions.submit(tx_blobs)
+
+
+    def submit_blob(self, tx_blob: str, handler=None, error_handler=None) -> None:
+        '''
+        Raw submit command, no tracking. Use `self.submit` unless you want to handle the response yourself
+        `error_handler` gets error replies (invalidTransaction, highFee, ...)
+        See `self.__submit_response` for example response
+        '''
+        # a fresh id per send, the same blob may be in flight more than once
+        payload = dict(command='submit', id=utils.generate_uuid(), tx_blob=tx_blob)
+        payload["handler"] = handler or self.__submit_response
+        if error_handler:
+            payload["error_handler"] = error_handler
+        self.send_request(payload)
+        return
+
+
+    def path_find(self, req: Dict, handler=None) -> None:
+        '''
+        https://xrpl.org/path_find.html
+
+        Raw path_find command (subcommand create / close / status)
+        Only one path_find can be open per connection, a new `create` replaces the old one.
+        Use `self.path_finds` to manage sessions rather than calling this directly
+
+        Example:
+            >>> self.path_find({
+                    'subcommand': 'create',
+                    'source_account': 'rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3',
+                    'destination_account': 'rf1BiGeXwwQoi8Z2ueFYTEXSwuJYfV2Jpn',
+                    'destination_amount': '1000000'
+                })
+
+            See `self.__path_find_response` for example response
+        '''
+        if not 'subcommand' in req:
+            raise KeyError('`subcommand` field required')
+
+        payload = dict(command='path_find')
+        if not 'id' in req:
+            payload['id'] = utils.generate_uuid()
+
+        payload.update(req)
+        payload["handler"] = handler or self.__path_find_response
+        self.send_request(payload)
+        return
+
+
+    def ripple_path_find(self, req: Dict, handler=None) -> None:
+        '''
+        https://xrpl.org/ripple_path_find.html
+
+        One-shot path search, no follow up updates
+
+        Example:
+            >>> self.ripple_path_find({
+                    'source_account': 'rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3',
+                    'destination_account': 'rf1BiGeXwwQoi8Z2ueFYTEXSwuJYfV2Jpn',
+                    'destination_amount': '1000000'
+                })
+        '''
+        for field in ('source_account', 'destination_account', 'destination_amount'):
+            if not field in req:
+                raise KeyError(f'`{field}` field required')
+
+        payload = dict(command='ripple_path_find', ledger_index='current')
+        if not 'id' in req:
+            payload['id'] = utils.generate_uuid()
+
+        payload.update(req)
+        payload["handler"] = handler or self.__path_find_response
+        self.send_request(payload)
         return
 
 
@@ -483,6 +681,66 @@ class XRPLWebsocketClient(WebsocketManager):
         return
 
 
+    def __submit_response(self, res):
+        '''
+        https://xrpl.org/submit.html
+
+        Example Response:
+        {
+            "id": "3c5d...",
+            "result": {
+                "accepted": true,
+                "applied": true,
+                "broadcast": true,
+                "engine_result": "tesSUCCESS",
+                "engine_result_code": 0,
+                "engine_result_message": "The transaction was applied. Only final in a validated ledger.",
+                "kept": true,
+                "queued": false,
+                "tx_blob": "1200002280000000240000016861D4838D7EA4C6800000...",
+                "tx_json": {
+                    "Account": "rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3",
+                    "Fee": "12",
+                    "LastLedgerSequence": 62744210,
+                    "Sequence": 360,
+                    "TransactionType": "Payment",
+                    "hash": "4D5D90890F8D49519E4151938601EF3D0B30B16CD6A519D9C99102C9FA77F7E0"
+                },
+                "validated_ledger_index": 62744196
+            },
+            "status": "success",
+            "type": "response"
+        }
+        '''
+        logger.info(f'Submit Response: {res}')
+
+
+    def __path_find_response(self, res):
+        '''
+        https://xrpl.org/path_find.html
+
+        Example Response:
+        {
+            "id": "8f2b...",
+            "result": {
+                "alternatives": [
+                {
+                    "paths_computed": [[{"currency": "USD", "issuer": "rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B", "type": 48}]],
+                    "source_amount": "1000245"
+                }
+                ],
+                "destination_account": "rf1BiGeXwwQoi8Z2ueFYTEXSwuJYfV2Jpn",
+                "destination_amount": "1000000",
+                "full_reply": false,
+                "source_account": "rLL8fVwvGU3MB9WsJci4nv1K1iEY3tx8T3"
+            },
+            "status": "success",
+            "type": "response"
+        }
+        '''
+        logger.info(f'Path Find: {res}')
+
+
     def __book_offers_response(self, res):
         '''
         On Demand Book Offer Response